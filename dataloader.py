@@ -4,23 +4,91 @@
 and uploads it into the specified Contributor Node"""
 
 import argparse
+import atexit
 import base64
+import codecs
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import copy
 import csv
+import functools
+import gzip
 import hashlib
+import importlib
+import io
+import itertools
+import json
+import mmap
 import os
+import queue
 import re
-import subprocess
+import sqlite3
 import sys
 import logging
-from distutils.util import strtobool
-from collections import OrderedDict
+import threading
+import time
+import unicodedata
+import zlib
 
-import regex
-import requests
-from requests.auth import HTTPBasicAuth
-from requests.packages.urllib3.exceptions import InsecureRequestWarning
+
+class LazyModule:
+    """LazyModule imports the module name on the first access to one of its attributes.
+    Short runs, e.g. --hashed delta loads, skip the import of what they do not use.
+    Unlike importlib.util.LazyLoader, concurrent first accesses are safe: they go through
+    the import system locks"""
+
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attr):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+        return getattr(self.module, attr)
+
+
+asyncio = LazyModule('asyncio')
+regex = LazyModule('regex')
+requests = LazyModule('requests')
+
+# Optional packages, imported by load_zstandard and load_pyarrow the first time they are needed
+zstandard = None
+pyarrow = None
+OPTIONAL_IMPORT_LOCK = threading.Lock()
+
+
+def load_zstandard():
+    """load_zstandard imports zstandard, returns None when it is not installed"""
+    global zstandard
+    with OPTIONAL_IMPORT_LOCK:
+        if zstandard is None:
+            try:
+                import zstandard
+            except ImportError:
+                zstandard = None
+    return zstandard
+
+
+def load_pyarrow():
+    """load_pyarrow imports pyarrow and the modules of the Parquet and Arrow formats,
+    returns None when it is not installed"""
+    global pyarrow
+    with OPTIONAL_IMPORT_LOCK:
+        if pyarrow is None:
+            try:
+                import pyarrow
+                import pyarrow.compute
+                import pyarrow.csv
+                import pyarrow.ipc
+                import pyarrow.parquet
+            except ImportError:
+                pyarrow = None
+    return pyarrow
 
 # Fields without salt are NOT going to be encrypted.
+# Fields with hash_cache have values repeating across lines, hashed through the --hash-cache.
 DATABANK_SENATE_MATCHING_MAPPING = {
     'personid': {
         'aliases': ['personid', 'natural_key'],
@@ -33,13 +101,15 @@ DATABANK_SENATE_MATCHING_MAPPING = {
         'aliases': ['family_name', 'family_names'],
         'mandatory': False,
         'multivalue': True,
-        'normalization': 'name'
+        'normalization': 'name',
+        'hash_cache': True
     },
     'given_name': {
         'aliases': ['given_name', 'first_name'],
         'mandatory': False,
         'multivalue': True,
-        'normalization': 'uppercase'
+        'normalization': 'uppercase',
+        'hash_cache': True
     },
     'email': {
         'aliases': ['email', 'contact_email_address', 'alternate_email_address'],
@@ -58,7 +128,8 @@ DATABANK_SENATE_MATCHING_MAPPING = {
         'aliases': ['dpid', 'contact_aus_dpid', 'alternate_aus_dpid'],
         'mandatory': False,
         'multivalue': True,
-        'normalization': 'int'
+        'normalization': 'int',
+        'hash_cache': True
     },
     'frequent_flyer_number': {
         'aliases': ['frequent_flyer_number'],
@@ -76,19 +147,22 @@ DATABANK_SENATE_MATCHING_MAPPING = {
         'aliases': ['custom_name'],
         'mandatory': False,
         'multivalue': True,
-        'normalization': 'name'
+        'normalization': 'name',
+        'hash_cache': True
     },
     'birthdate': {
         'aliases': ['birthdate'],
         'mandatory': False,
         'multivalue': False,
-        'normalization': 'numeric'
+        'normalization': 'numeric',
+        'hash_cache': True
     },
     'postcode': {
         'aliases': ['postcode'],
         'mandatory': False,
         'multivalue': False,
-        'normalization': 'numeric'
+        'normalization': 'numeric',
+        'hash_cache': True
     },
     'operation': {
         'aliases': ['operation', 'opr_typr'],
@@ -99,20 +173,104 @@ DATABANK_SENATE_MATCHING_MAPPING = {
     }
 }
 
+# DATABANK_HEADERS, MATCH and ROW_PLAN below, the salts of DATABANK_SENATE_MATCHING_MAPPING,
+# the buffer file names, the upload compression and TRANSPORT are the state of DEFAULT_LOADER.
+# Every other Loader has its own, see Loader
+
 # DATABANK_HEADERS is used to retrieve general details regarding the databank header given
 # It will provide the position of the header, the Senate matching equivalent and the number
 # of matching occurences
-# Ex: {'natural_key': {'pos': 0, 'match': 'personid', 'multivalue':
-#     {'multi_pos': 1, 'multi_max': 1}}}
+# Ex: {'natural_key': {'pos': 0, 'match': 'personid', 'multi_pos': 1, 'multi_max': 1}}
 DATABANK_HEADERS = {}
 
 # MATCH gives direct equivalent of in-context DATABANK_FIELD to Senate Matching field
 # Ex: {'natural_key': 'personid', 'phone': 'phone:0', 'email': 'email:0'}
 MATCH = {}
 
+# ROW_PLAN is the compiled form of the headers used by parse_line. One entry per valid
+# header, in output order: (column index, output key, normalizer, column hasher or None)
+# Ex: [(0, 'personid', normalize_str, None), (3, 'phone:0', normalize_phone, <hasher>)]
+ROW_PLAN = []
+
 MANDATORY_ENVIRONMENT_FIELDS = ['HITCH_CONTRIBUTOR_NODE', 'HITCH_API_KEY']
 HITCH_BUF_FILENAME = '.dataloader_script.csv'
+# Number of lines hashed at once, and shipped to a worker process with --workers
+BATCH_ROWS = 10000
+# Size of the windows searched for line boundaries with --mmap
+MMAP_WINDOW_BYTES = 1024 * 1024
+# Memory maps of the --mmap input files opened by the worker processes, by mapped_key
+MAPPED_FILES = {}
+# Memory maps owned by the open MappedCSV readers of this process, by mapped_key
+OPEN_MAPPED_FILES = {}
+# --stats collector, None when disabled so that instrumentation is a single test
+STATS = None
+STATS_PROGRESS_SECONDS = 30
+NO_STATS_TIMER = contextlib.nullcontext()
+# Size of the GetPersonTokens response chunks read, and lines per write of the mapping file
+TOKENS_CHUNK_BYTES = 1024 * 1024
+OUTPUT_BATCH_ROWS = 10000
+# Batches queued between the reader, hashing and writer stages, and size of the buffer
+# file write buffer
+PIPELINE_QUEUE_BATCHES = 4
+PIPELINE_POLL_SECONDS = 0.1
+PIPELINE_END = object()
+WRITE_BUFFER_BYTES = 4 * 1024 * 1024
+# Approximate size of a hash cache entry: key, base64 digest and LRU bookkeeping
+HASH_CACHE_ENTRY_BYTES = 400
+# LRU memoized salted_hash of the default loader, see configure_hash_cache
+HASH_CACHE_MEGABYTES = 0
+cached_salted_hash = None
+# Hash cache hits and misses reported by the worker processes to the default loader
+HASH_CACHE_WORKER_COUNTERS = {'hits': 0, 'misses': 0}
 UPLOAD_FILENAME = HITCH_BUF_FILENAME
+# Checkpoint of a chunked load, per input file and DBUUID
+MANIFEST_FILENAME = '.dataloader_{}_{}.manifest.jsonl'
+# Number of input lines per chunk when --resume is given without --chunk-rows
+RESUME_CHUNK_ROWS = 50000
+# Files larger than UPLOAD_SIZE_LIMIT bytes are too large for a single upload, and uploaded
+# by chunks of about UPLOAD_CHUNK_BYTES
+UPLOAD_SIZE_LIMIT = 2 * 1024 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 64 * 1024 * 1024
+# --hashed input: values are checked to be empty or a base64 SHA-512 digest instead of
+# being normalized and hashed, see compile_row_plan
+HASHED_INPUT = False
+DIGEST_PATTERN = re.compile(r'[A-Za-z0-9+/]{86}==')
+# Timeouts in seconds of the requests to the Contributor Node: connection, then every read
+HTTP_CONNECT_TIMEOUT = 10
+HTTP_READ_TIMEOUT = 600
+# Retries of a request that failed to connect, timed out or got one of HTTP_RETRY_STATUSES,
+# waiting HTTP_BACKOFF_SECONDS, then twice as long every time. POST requests that timed out
+# are not retried, see retry_class
+HTTP_RETRIES = 5
+HTTP_BACKOFF_SECONDS = 1
+HTTP_RETRY_STATUSES = (429, 502, 503, 504)
+# Transport shared by the requests to the Contributor Node, see shared_transport
+TRANSPORT = None
+# Content-Encoding of the LoadHashedRecords uploads, None for plain uploads. Back to None
+# once the Contributor Node rejected a compressed upload with one of
+# UPLOAD_COMPRESSION_REJECTED_STATUSES
+UPLOAD_COMPRESSION = None
+UPLOAD_COMPRESSION_LEVELS = {'gzip': 6, 'zstd': 3}
+UPLOAD_COMPRESSION_REJECTED_STATUSES = (400, 415)
+# Keep the buffer file gzip compressed on disk, with a fast compression level
+BUFFER_COMPRESSION = False
+BUFFER_COMPRESSLEVEL = 1
+# Index of the lines of the last successful load with --delta, per DBUUID
+DELTA_INDEX_FILENAME = '.dataloader_{}.delta.sqlite'
+# operation value of the lines removing a personid from the Contributor Node
+DELTA_DELETE_OPERATION = 'D'
+# Number of personids looked up at once in the delta index
+DELTA_LOOKUP_ROWS = 500
+# Salts of GlobalConfig cached with --salt-cache, only used for the same Contributor Node and
+# SALT_CACHE_VERSION, up to SALT_CACHE_TTL_HOURS after they were retrieved
+SALT_CACHE_FILENAME = os.path.join('~', '.dataloader_salts.json')
+SALT_CACHE_VERSION = 1
+SALT_CACHE_TTL_HOURS = 24
+# Loader of the load running in the current thread or task, DEFAULT_LOADER when unset.
+# See current_loader
+CURRENT_LOADER = contextvars.ContextVar('CURRENT_LOADER')
+# Suffix of the buffer file of every Loader
+LOADER_IDS = itertools.count(1)
 
 
 # A logger that will print DEBUG and INFO to stdout, WARNING and ERROR to stderr
@@ -132,18 +290,179 @@ class DuplicatedColumnError(Exception):
    """Raised when the file contains multiple columns with the same name"""
    pass
 
+class UploadAbortedError(Exception):
+   """Raised in a streamed upload body when hashing failed"""
+   pass
+
 
 logger = logging.getLogger('__name__')
 logger.setLevel(logging.DEBUG)
 
-h1 = logging.StreamHandler(sys.stdout)
-h1.setLevel(logging.DEBUG)
-h1.addFilter(InfoFilter())
-h2 = logging.StreamHandler()
-h2.setLevel(logging.WARNING)
 
-logger.addHandler(h1)
-logger.addHandler(h2)
+def setup_logging():
+    """setup_logging adds the stdout and stderr handlers of the logger, once.
+    Called by the command line tools, not on import, so that library users keep
+    their own logging configuration"""
+    if logger.handlers:
+        return
+    h1 = logging.StreamHandler(sys.stdout)
+    h1.setLevel(logging.DEBUG)
+    h1.addFilter(InfoFilter())
+    h2 = logging.StreamHandler()
+    h2.setLevel(logging.WARNING)
+
+    logger.addHandler(h1)
+    logger.addHandler(h2)
+
+
+def current_loader():
+    """current_loader returns the Loader of the running load, whose state the module
+    functions use. It is DEFAULT_LOADER, backed by the module globals, outside of Loader.load"""
+    return CURRENT_LOADER.get(DEFAULT_LOADER)
+
+
+def in_current_context(func):
+    """in_current_context returns func run in a copy of the current context, so that
+    the thread running it works for the same Loader as the one that started it"""
+    return functools.partial(contextvars.copy_context().run, func)
+
+
+@functools.lru_cache(maxsize=None)
+def retry_class():
+    """retry_class returns the urllib3 Retry of the transports, defined on first use as
+    requests is imported lazily. A POST request that timed out or lost its connection
+    while waiting for the answer is not sent again: the Contributor Node may still be
+    loading its lines"""
+    class UploadRetry(requests.packages.urllib3.util.retry.Retry):
+        def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+            if (method == 'POST' and self.read is not False and error is not None
+                    and self._is_read_error(error)):
+                return self.new(read=False).increment(method, url, response, error, *args, **kwargs)
+            return super().increment(method, url, response, error, *args, **kwargs)
+    return UploadRetry
+
+
+class Transport:
+    """Transport is the HTTP client of the Contributor Node: a session pooling up to
+    pool_maxsize keep-alive connections, with timeouts and exponential backoff retries.
+    POST requests that failed to connect or got one of HTTP_RETRY_STATUSES are retried
+    too, loading the same hashed lines twice is harmless"""
+
+    def __init__(self, pool_maxsize=4, read_timeout=HTTP_READ_TIMEOUT, retries=HTTP_RETRIES,
+                 backoff=HTTP_BACKOFF_SECONDS):
+        self.timeout = (HTTP_CONNECT_TIMEOUT, read_timeout)
+        retry = retry_class()(
+            total=retries, backoff_factor=backoff,
+            status_forcelist=HTTP_RETRY_STATUSES,
+            allowed_methods=frozenset(['GET', 'POST']),
+            # Hand the last response over once retries are exhausted
+            raise_on_status=False)
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method, url, **kwargs):
+        """request is requests.request over the pooled session, with the default timeouts"""
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """get sends a GET request"""
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """post sends a POST request"""
+        return self.request('POST', url, **kwargs)
+
+    def prepare(self, method, url, **kwargs):
+        """prepare returns the prepared request, with the session auth and headers"""
+        return self.session.prepare_request(requests.Request(method, url, **kwargs))
+
+    def send(self, prepared, **kwargs):
+        """send sends a prepared request with the environment settings and default
+        timeouts, as request does"""
+        settings = self.session.merge_environment_settings(
+            prepared.url, kwargs.pop('proxies', {}), kwargs.pop('stream', None),
+            kwargs.pop('verify', None), kwargs.pop('cert', None))
+        settings.update(kwargs)
+        settings.setdefault('timeout', self.timeout)
+        return self.session.send(prepared, **settings)
+
+    def close(self):
+        """close closes the pooled connections"""
+        self.session.close()
+
+
+class AsyncTransport:
+    """AsyncTransport is the asyncio variant of Transport. Requests run on a pool of
+    max_concurrency threads, so that chunk uploads and token fetches can be awaited
+    together from a single event loop"""
+
+    def __init__(self, transport=None, max_concurrency=4):
+        self.transport = transport or shared_transport()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def run(self, func, *args, **kwargs):
+        """run awaits func(*args, **kwargs) run by the thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, in_current_context(functools.partial(func, *args, **kwargs)))
+
+    async def request(self, method, url, **kwargs):
+        """request awaits Transport.request"""
+        return await self.run(self.transport.request, method, url, **kwargs)
+
+    async def get(self, url, **kwargs):
+        """get awaits a GET request"""
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        """post awaits a POST request"""
+        return await self.request('POST', url, **kwargs)
+
+    def close(self):
+        """close waits for the requests in flight"""
+        self.executor.shutdown()
+
+
+def configure_transport(pool_maxsize=4, read_timeout=HTTP_READ_TIMEOUT, retries=HTTP_RETRIES,
+                        backoff=HTTP_BACKOFF_SECONDS):
+    """configure_transport replaces the shared transport of the current loader"""
+    loader = current_loader()
+    if loader.transport is not None:
+        loader.transport.close()
+    loader.transport = Transport(pool_maxsize, read_timeout, retries, backoff)
+    return loader.transport
+
+
+def shared_transport():
+    """shared_transport returns the transport shared by the requests to the Contributor
+    Node of the current loader, made with the default settings unless configure_transport
+    was called"""
+    loader = current_loader()
+    if loader.transport is None:
+        configure_transport()
+    return loader.transport
+
+
+def strtobool(value):
+    """strtobool converts a truth value to 1 or 0 as distutils.util.strtobool does,
+    distutils being deprecated and slow to import"""
+    value = value.lower()
+    if value in ('y', 'yes', 't', 'true', 'on', '1'):
+        return 1
+    if value in ('n', 'no', 'f', 'false', 'off', '0'):
+        return 0
+    raise ValueError('invalid truth value {!r}'.format(value))
+
+
+def positive_int(value):
+    """positive_int is the argparse type of the counts of at least 1"""
+    count = int(value)
+    if count < 1:
+        raise argparse.ArgumentTypeError('{} is not 1 or more'.format(value))
+    return count
 
 
 def requests_ca_verify():
@@ -164,37 +483,58 @@ def requests_ca_verify():
 
 def retrieve_salts(hostname, static_auth, ca_verify=True):
     """retrieve salt value per field from GlobalConfig"""
+    salts = fetch_salts(hostname, static_auth, ca_verify)
+    if salts is None:
+        return False
+    set_salts(salts)
+    return True
+
+
+def fetch_salts(hostname, static_auth, ca_verify=True):
+    """fetch_salts returns the salt per field of GlobalConfig, or None when it could not
+    be retrieved"""
     try:
-        salt_req = requests.get(hostname + 'GlobalConfig', auth=static_auth, verify=ca_verify)
+        salt_req = shared_transport().get(hostname + 'GlobalConfig', auth=static_auth,
+                                          verify=ca_verify)
         salt_req.raise_for_status()
-        payload = salt_req.json()
-
-        for field_def in [('Fields', 'FieldName'), ('FieldQualifiers', 'Name')]:
-            type_def, name_def = field_def
-            for field in payload[type_def]:
-                name = payload[type_def][field][name_def]
-                if name in DATABANK_SENATE_MATCHING_MAPPING and \
-                        DATABANK_SENATE_MATCHING_MAPPING[name].get('salt', True):
-                    DATABANK_SENATE_MATCHING_MAPPING[name]['salt'] = payload[type_def][field][
-                        'HashSalt']
-        return True
+        return global_config_salts(salt_req.json())
     except requests.exceptions.SSLError:
         logger.error("Error: Invalid certificate. Update your environment variables "
                "by either using your system's trusted CAs with "
                "REQUESTS_CA_BUNDLE or set REQUESTS_CA_VERIFY to false")
-        return False
-    except requests.exceptions.ConnectionError:
+        return None
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         logger.error('Error: contributor node is unreachable')
-        return False
+        return None
     except requests.HTTPError as ex:
         logger.error('Error {}: {}'.format(salt_req.status_code, salt_req.text.rstrip()))
-        return False
+        return None
     except ValueError:
         logger.error('Error: error decoding the response')
-        return False
+        return None
     except KeyError as ex:
         logger.error('Error: invalid payload received. KeyError: {}'.format(ex))
-        return False
+        return None
+
+
+def global_config_salts(payload):
+    """global_config_salts returns the salt of every field of a GlobalConfig payload"""
+    mapping = current_loader().mapping
+    salts = {}
+    for field_def in [('Fields', 'FieldName'), ('FieldQualifiers', 'Name')]:
+        type_def, name_def = field_def
+        for field in payload[type_def]:
+            name = payload[type_def][field][name_def]
+            if name in mapping and mapping[name].get('salt', True):
+                salts[name] = payload[type_def][field]['HashSalt']
+    return salts
+
+
+def set_salts(salts):
+    """set_salts sets the salt of every field of salts"""
+    mapping = current_loader().mapping
+    for field in salts:
+        mapping[field]['salt'] = salts[field]
 
 
 def override_temp_buffer_name(some_input):
@@ -202,22 +542,29 @@ def override_temp_buffer_name(some_input):
        Does nothing for STDIN
        Change to filename if it's given a file descriptor
        Or set to string elsewise"""
-    global UPLOAD_FILENAME
     if some_input != sys.stdin:
         if 'name' in dir(some_input):
-            UPLOAD_FILENAME = some_input.name.split('/')[-1]
+            current_loader().upload_filename = some_input.name.split('/')[-1]
         else:
-            UPLOAD_FILENAME = str(some_input)
+            current_loader().upload_filename = str(some_input)
 
 def recover_temp_buffer_name():
     """simply recover the buffer name after override"""
-    global HITCH_BUF_FILENAME
-    global UPLOAD_FILENAME
-    UPLOAD_FILENAME = HITCH_BUF_FILENAME
+    loader = current_loader()
+    loader.upload_filename = loader.buf_filename
+
+def csv_reader(lines, delimiter):
+    """csv_reader returns the csv.reader of the input lines"""
+    return csv.reader(lines, skipinitialspace=True, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+
 
 def read_csv(input_type, delimiter, exit_on_failure=False):
-    """read_csv_stdin processes CSV from stdin line by line"""
-    csvReader = csv.reader(iter(input_type.readline, ''), skipinitialspace=True, delimiter=delimiter, quoting=csv.QUOTE_NONE)
+    """read_csv processes CSV from input_type line by line.
+    The header row is yielded first, then every line as a plain list of fields"""
+    readline = input_type.readline
+    if STATS is not None:
+        readline = STATS.counted_readline(readline)
+    csvReader = csv_reader(iter(readline, ''), delimiter)
     try:
         headers = next(csvReader)
     except StopIteration:
@@ -232,55 +579,292 @@ def read_csv(input_type, delimiter, exit_on_failure=False):
             exit(1)
         raise DuplicatedColumnError
 
-    for row in csvReader:
-        odict = OrderedDict()
-        for idx, field in enumerate(row):
-            try:
-                odict[headers[idx]] = field
-            except IndexError:
-                logger.error("The file you're trying to upload has more fields compared to the header row")
-                if exit_on_failure:
-                    exit(1)
-                raise InvalidFileHeadersError
-        if len(odict) < len(headers):
+    yield headers
+    yield from check_rows(csvReader, len(headers), exit_on_failure)
+
+
+def check_rows(rows, header_count, exit_on_failure=False):
+    """check_rows makes sure every row has as many fields as the header row"""
+    for row in rows:
+        if len(row) > header_count:
+            logger.error("The file you're trying to upload has more fields compared to the header row")
+            if exit_on_failure:
+                exit(1)
+            raise InvalidFileHeadersError
+        if len(row) < header_count:
             logger.error("The file you're trying to upload has less fields compared to the header row")
             if exit_on_failure:
                 exit(1)
             raise InvalidLineError
-        yield odict
+        yield row
+
+class MappedCSV:
+    """MappedCSV reads a regular file like read_csv, except that lines are handed
+    out by batches of byte ranges of the memory-mapped file (see MappedBlock)
+    instead of lists of fields. Lines must end with LF or CRLF"""
+
+    def __init__(self, filename, delimiter, exit_on_failure=False):
+        self.filename = filename
+        self.delimiter = delimiter
+        self.exit_on_failure = exit_on_failure
+        self.key, self.mapped = map_file(filename)
+        OPEN_MAPPED_FILES[self.key] = self.mapped
+        self.offset = 0
+        self.header_count = None
+
+    def close(self):
+        """close unmaps the file, its blocks cannot be read anymore in this process"""
+        if OPEN_MAPPED_FILES.get(self.key) is self.mapped:
+            del OPEN_MAPPED_FILES[self.key]
+        if isinstance(self.mapped, mmap.mmap):
+            self.mapped.close()
+        self.mapped = b''
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """The header row is the only element of a MappedCSV, see batches"""
+        if self.header_count is not None or not len(self.mapped):
+            if self.header_count is None:
+                logger.debug("The file you're trying to upload is empty")
+                if self.exit_on_failure:
+                    exit(1)
+            raise StopIteration
+        self.offset = find_line_offset(self.mapped, 0, 1)
+        header_line = self.mapped[:self.offset].decode('utf-8')
+        headers = next(read_csv(io.StringIO(header_line), self.delimiter, self.exit_on_failure))
+        self.header_count = len(headers)
+        return headers
+
+    def skip(self, lines):
+        """skip moves past the next lines without reading them"""
+        self.offset = find_line_offset(self.mapped, self.offset, lines)
+
+    def batches(self, batch_rows):
+        """batches yields a MappedBlock for every batch_rows lines"""
+        while self.offset < len(self.mapped):
+            end = find_line_offset(self.mapped, self.offset, batch_rows)
+            if STATS is not None:
+                STATS.add('bytes_read', end - self.offset)
+            yield MappedBlock(self.key, self.offset, end, self.delimiter, self.header_count)
+            self.offset = end
+
+
+class MappedBlock(collections.namedtuple('MappedBlock',
+                                         ['key', 'start', 'end', 'delimiter', 'header_count'])):
+    """MappedBlock is a batch of lines given as a byte range of a memory-mapped file,
+    key being the mapped_key of the file. The lines are only decoded and parsed by the
+    process hashing the batch"""
+
+    def rows(self):
+        """rows returns the lines of the block as lists of fields"""
+        text = mapped_file(self.key)[self.start:self.end].decode('utf-8')
+        return list(check_rows(csv_reader(io.StringIO(text), self.delimiter), self.header_count))
+
+
+def mapped_key(filename, stat):
+    """mapped_key identifies a version of filename: a file replaced or rewritten
+    in place gets another key"""
+    return (filename, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def map_file(filename):
+    """map_file returns the mapped_key of filename and its read only memory map"""
+    with open(filename, 'rb') as mapped_fd:
+        key = mapped_key(filename, os.fstat(mapped_fd.fileno()))
+        if key[2] == 0:
+            # Empty files cannot be mapped
+            return key, b''
+        return key, mmap.mmap(mapped_fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def mapped_file(key):
+    """mapped_file returns the memory map of the file version key: the map of its open
+    MappedCSV, or a map opened once per worker process. Maps of the previous versions
+    of the file are closed"""
+    if key in OPEN_MAPPED_FILES:
+        return OPEN_MAPPED_FILES[key]
+    if key not in MAPPED_FILES:
+        new_key, mapped = map_file(key[0])
+        if new_key != key:
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+            raise OSError('{} changed while it was loaded'.format(key[0]))
+        for stale_key in [stale for stale in MAPPED_FILES if stale[0] == key[0]]:
+            stale_map = MAPPED_FILES.pop(stale_key)
+            if isinstance(stale_map, mmap.mmap):
+                stale_map.close()
+        MAPPED_FILES[key] = mapped
+    return MAPPED_FILES[key]
+
+
+def find_line_offset(mapped, start, lines):
+    """find_line_offset returns the offset following the next lines lines from start.
+    Newlines are counted by windows of MMAP_WINDOW_BYTES"""
+    pos = start
+    while lines and pos < len(mapped):
+        window = mapped[pos:pos + MMAP_WINDOW_BYTES]
+        newlines = window.count(b'\n')
+        if newlines < lines:
+            lines -= newlines
+            pos += len(window)
+            continue
+        idx = -1
+        for _ in range(lines):
+            idx = window.find(b'\n', idx + 1)
+        return pos + idx + 1
+    return len(mapped)
+
+
+def skip_lines(iterator, lines):
+    """skip_lines moves iterator past the next lines without processing them"""
+    if isinstance(iterator, (MappedCSV, ArrowReader)):
+        iterator.skip(lines)
+    else:
+        collections.deque(itertools.islice(iterator, lines), maxlen=0)
+
+
+class ArrowReader:
+    """ArrowReader reads a Parquet or Arrow IPC file like read_csv, except that lines
+    are handed out by batches of columns (see ColumnBlock). Only the columns of ROW_PLAN
+    are read, and values are turned into strings by Arrow, nulls being empty strings"""
+
+    def __init__(self, filename, input_format):
+        self.filename = filename
+        self.input_format = input_format
+        load_pyarrow()
+        if input_format == 'parquet':
+            self.parquet_file = pyarrow.parquet.ParquetFile(filename)
+            self.names = self.parquet_file.schema_arrow.names
+        else:
+            # Memory mapped, record batches are read without copy
+            self.table = pyarrow.ipc.open_file(pyarrow.memory_map(filename)).read_all()
+            self.names = self.table.schema.names
+        self.headers_read = False
+        self.skipped = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """The header row is the only element of an ArrowReader, see batches"""
+        if self.headers_read:
+            raise StopIteration
+        self.headers_read = True
+        return list(self.names)
+
+    def skip(self, lines):
+        """skip moves past the next lines without reading them"""
+        self.skipped += lines
+
+    def record_batches(self, names, batch_rows):
+        """record_batches yields the record batches of the names columns"""
+        if self.input_format == 'parquet':
+            yield from self.parquet_file.iter_batches(batch_size=batch_rows, columns=names)
+        else:
+            yield from self.table.select(names).to_batches(max_chunksize=batch_rows)
+
+    def batches(self, batch_rows):
+        """batches yields a ColumnBlock for every batch_rows lines"""
+        positions = sorted({pos for pos, _, _, _ in current_loader().row_plan})
+        names = [self.names[pos] for pos in positions]
+        skip = self.skipped
+        pending = []
+        pending_rows = 0
+        for record_batch in self.record_batches(names, batch_rows):
+            if skip:
+                if skip >= record_batch.num_rows:
+                    skip -= record_batch.num_rows
+                    continue
+                record_batch = record_batch.slice(skip)
+                skip = 0
+            pending.append(record_batch)
+            pending_rows += record_batch.num_rows
+            # Row groups do not end on batch_rows boundaries, chunks of lines must
+            while pending_rows >= batch_rows:
+                table = pyarrow.Table.from_batches(pending)
+                yield column_block(table.slice(0, batch_rows), positions)
+                pending = table.slice(batch_rows).to_batches()
+                pending_rows -= batch_rows
+        if pending_rows:
+            yield column_block(pyarrow.Table.from_batches(pending), positions)
+
+
+class ColumnBlock(collections.namedtuple('ColumnBlock', ['columns', 'row_count'])):
+    """ColumnBlock is a batch of lines given column by column: columns maps the index
+    of every input column of ROW_PLAN to the list of its values"""
+
+
+def column_block(table, positions):
+    """column_block returns the ColumnBlock of table, whose columns are the input
+    columns at positions"""
+    with stage_timer('read_csv'):
+        if STATS is not None:
+            STATS.add('bytes_read', table.nbytes)
+        columns = {}
+        for pos, column in zip(positions, table.columns):
+            if not (pyarrow.types.is_string(column.type) or
+                    pyarrow.types.is_large_string(column.type)):
+                column = pyarrow.compute.cast(column, pyarrow.string())
+            columns[pos] = pyarrow.compute.fill_null(column, '').to_pylist()
+    return ColumnBlock(columns, table.num_rows)
+
 
 def find_matching_field(header):
     """find_matching_field returns the exact matching field for an alias"""
-    for field in DATABANK_SENATE_MATCHING_MAPPING:
-        if header in DATABANK_SENATE_MATCHING_MAPPING[field]['aliases']:
+    mapping = current_loader().mapping
+    for field in mapping:
+        if header in mapping[field]['aliases']:
             return field
     return None
 
 
+def find_output_field(header):
+    """find_output_field returns the field of an output key of parse_headers, field or
+    field:N, as written by a previous load or csv2hitchcsv"""
+    field, separator, index = header.partition(':')
+    if field in current_loader().mapping and (not separator or index.isdigit()):
+        return field
+    return None
+
+
 def list_mandatory_field_aliases():
     """list_mandatory_field_aliases returns a dict of mandatory aliases to their primary key"""
+    mapping = current_loader().mapping
     aliases = {}
-    for field in DATABANK_SENATE_MATCHING_MAPPING:
-        if DATABANK_SENATE_MATCHING_MAPPING[field]['mandatory']:
-            for alias in DATABANK_SENATE_MATCHING_MAPPING[field]['aliases']:
+    for field in mapping:
+        if mapping[field]['mandatory']:
+            for alias in mapping[field]['aliases']:
                 aliases[alias] = field
     return aliases
 
 
 def parse_headers(headers):
     """parse_headers check for the validity of the headers
-    basically update DATABANK_HEADERS"""
-
-    mandatory_fields = [f for f in DATABANK_SENATE_MATCHING_MAPPING
-                        if DATABANK_SENATE_MATCHING_MAPPING[f]['mandatory']]
+    basically update DATABANK_HEADERS of the current loader, replacing the headers
+    of a previous file"""
+    loader = current_loader()
+    databank_headers = loader.databank_headers
+    match = loader.match
+    databank_headers.clear()
+    match.clear()
+
+    mandatory_fields = [f for f in loader.mapping if loader.mapping[f]['mandatory']]
     aliases_mandatory_fields = list_mandatory_field_aliases()
     multivalue_matching_fields = {}
     # Ordered list of valid headers
     valid_headers = []
 
     # First loop looking at match equivalent, mandatory fields and multi value position
-    for header in headers:
+    for pos, header in enumerate(headers):
         matching_field = find_matching_field(header)
+        if matching_field is None and loader.hashed_input:
+            # Pre-hashed files may use the output keys, a column is never dropped
+            matching_field = find_output_field(header)
+            if matching_field is None:
+                logger.error('Error: [{}] header of the hashed file is not expected'.format(header))
+                raise InvalidFileHeadersError
         if matching_field is None:
             logger.warning('Warning: [{}] header is not expected and will be ignored'.format(header))
             continue
@@ -295,7 +879,8 @@ def parse_headers(headers):
         else:
             multivalue_matching_fields[matching_field] = 1
 
-        DATABANK_HEADERS[header] = {'match': matching_field,
+        databank_headers[header] = {'pos': pos,
+                                    'match': matching_field,
                                     'multi_pos': multivalue_matching_fields[matching_field],
                                     'multi_max': -1}
         valid_headers.append(header)
@@ -306,109 +891,615 @@ def parse_headers(headers):
         raise InvalidFileHeadersError
 
     # Count of max multi value field per header
-    for header in DATABANK_HEADERS:
-        db_hdr = DATABANK_HEADERS[header]
+    for header in databank_headers:
+        db_hdr = databank_headers[header]
         collision_field = db_hdr['match']
         if collision_field in multivalue_matching_fields:
             db_hdr['multi_max'] = multivalue_matching_fields[collision_field]
 
     # Make of MATCH map using multi values previously generated
-    for header in DATABANK_HEADERS:
-        if DATABANK_HEADERS[header]['multi_max'] > 1:
-            MATCH[header] = DATABANK_HEADERS[header]['match'] + ':' \
-                            + str(DATABANK_HEADERS[header]['multi_pos'] - 1)
+    for header in databank_headers:
+        if databank_headers[header]['multi_max'] > 1:
+            match[header] = databank_headers[header]['match'] + ':' \
+                            + str(databank_headers[header]['multi_pos'] - 1)
+        else:
+            match[header] = databank_headers[header]['match']
+
+    loader.row_plan[:] = compile_row_plan(row_plan_spec(valid_headers))
+    return [match[hd] for hd in valid_headers]
+
+
+def row_plan_spec(headers):
+    """row_plan_spec returns the (column index, output key, field) triples of the parsed
+    headers. Unlike ROW_PLAN, it can be shipped to another process"""
+    loader = current_loader()
+    return [(loader.databank_headers[hd]['pos'], loader.match[hd],
+             loader.databank_headers[hd]['match'])
+            for hd in headers if hd in loader.match]
+
+
+def compile_row_plan(spec):
+    """compile_row_plan turns a row_plan_spec into ROW_PLAN entries. With HASHED_INPUT,
+    values are kept as is and the hashers only check the digests"""
+    loader = current_loader()
+    plan = []
+    for pos, output_key, field in spec:
+        mapping = loader.mapping[field]
+        normalizer = NORMALIZERS.get(mapping['normalization'], normalize_str)
+        if loader.hashed_input:
+            normalizer = str
+        # The primary key and the fields declared without salt must not be hashed
+        if mapping.get('primary', False) or mapping.get('salt') is False:
+            hasher = None
+        elif loader.hashed_input:
+            hasher = functools.partial(check_digest_column, field)
+        else:
+            hasher = column_hasher(field)
+        plan.append((pos, output_key, normalizer, hasher))
+    return plan
+
+
+def build_narrow_table():
+    """build_narrow_table returns a str.translate table converting Asian wide
+    characters to their narrow equivalent, the same way width.Narrow does in toNarrow.go"""
+    table = {}
+    # Every <wide> and <narrow> decomposition lives in the Halfwidth and Fullwidth
+    # Forms block, except for the ideographic space
+    for code_point in [0x3000] + list(range(0xFF00, 0xFFF0)):
+        decomposition = unicodedata.decomposition(chr(code_point)).split()
+        if len(decomposition) != 2 or decomposition[0] not in ('<wide>', '<narrow>'):
+            continue
+        if decomposition[0] == '<wide>':
+            wide, narrow = code_point, int(decomposition[1], 16)
         else:
-            MATCH[header] = DATABANK_HEADERS[header]['match']
+            wide, narrow = int(decomposition[1], 16), code_point
+        # width.Narrow only folds Fullwidth, Wide and Ambiguous runes
+        if unicodedata.east_asian_width(chr(wide)) in ('F', 'W', 'A'):
+            table[wide] = narrow
+    return table
+
+
+NARROW_TABLE = build_narrow_table()
+
+
+def to_narrow(value):
+    """to_narrow converts Asian wide strings to narrow. See toNarrow.go"""
+    return value.translate(NARROW_TABLE)
+
+
+# Unicode classes of the regex package, compiled by compile_unicode_regexes on first use
+WHITESPACE_REGEX = None
+NON_LETTER_REGEX = None
+NON_DIGIT_REGEX = re.compile('[^0-9]')
+PHONE_FILTER = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+PHONE_TRANSLATION = "01234567892223334445556667777888999922233344455566677778889999"
+
+
+def compile_unicode_regexes():
+    """compile_unicode_regexes compiles the regexes of normalize_email and normalize_name.
+    Compiling them twice from two threads is harmless"""
+    global WHITESPACE_REGEX, NON_LETTER_REGEX
+    NON_LETTER_REGEX = regex.compile(r'\P{L}')
+    WHITESPACE_REGEX = regex.compile(r'\p{Z}')
+
+
+def normalize_email(value):
+    """normalize_email lowercases and removes every unicode separator"""
+    if WHITESPACE_REGEX is None:
+        compile_unicode_regexes()
+    return WHITESPACE_REGEX.sub('', value.translate(NARROW_TABLE).lower())
+
+
+def normalize_uppercase(value):
+    """normalize_uppercase uppercases and strips"""
+    return value.translate(NARROW_TABLE).upper().strip()
+
+
+def normalize_phone(value):
+    """normalize_phone keeps alphanumerics and converts letters to keypad digits"""
+    return value.translate(PHONE_TABLE)
 
-    return [MATCH[hd] for hd in valid_headers]
+
+def normalize_numeric(value):
+    """normalize_numeric keeps digits only"""
+    return NON_DIGIT_REGEX.sub('', value.translate(NARROW_TABLE))
+
+
+def normalize_name(value):
+    """normalize_name lowercases and keeps letters only"""
+    if NON_LETTER_REGEX is None:
+        compile_unicode_regexes()
+    return NON_LETTER_REGEX.sub('', value.translate(NARROW_TABLE).lower())
+
+
+def normalize_str(value):
+    """normalize_str only converts wide characters to narrow"""
+    return value.translate(NARROW_TABLE)
+
+
+NORMALIZERS = {
+    'email': normalize_email,
+    'uppercase': normalize_uppercase,
+    'phone': normalize_phone,
+    'numeric': normalize_numeric,
+    'name': normalize_name,
+    'str': normalize_str
+}
 
 
 def normalize(value, normalization_method):
     """normalize performs operations of value parameter
     to transform it in a normalized senate matching format"""
-
-    # optional conversion of Asian wide strings to narrow. See Makefile and toNarrow.go
-    exe = os.path.join(os.path.realpath(__file__), "tonarrow")
-    if os.path.isfile(exe) and os.access(exe, os.X_OK):
-        the_bytes = value.encode('utf-8')
-        result = subprocess.run(exe, stdout=subprocess.PIPE, input=the_bytes)
-        value = result.stdout.decode('utf-8').rstrip()
-
     if value is None:
         return ''
-
-    if normalization_method == 'email':
-        whitespace = regex.compile('\p{Z}')
-        return whitespace.sub('', value.lower())
-    elif normalization_method == 'uppercase':
-        return value.upper().strip()
-    elif normalization_method == 'phone':
-        convert_from = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        convert_to = "01234567892223334445556667777888999922233344455566677778889999"
-        return filter_and_translator(value, convert_from, convert_to)
-    elif normalization_method == 'numeric':
-        return re.sub("[^0-9]", "", value)
-    elif normalization_method == 'name':
-        nonLetters = regex.compile('\P{L}')
-        return nonLetters.sub('', value.lower())
-    return str(value)
+    return NORMALIZERS.get(normalization_method, normalize_str)(value)
 
 
 def filter_and_translator(input_str, filters, translate_to_chars):
     """filter_and_translator replace characters from input_str by
     equivalent from filters array on translate_to_chars"""
-    new_buf = ''
-    for c_input_str in input_str:
-        f_count = 0
-        for c_filter in filters:
-            if c_input_str == c_filter:
-                if f_count < len(translate_to_chars):
-                    new_buf += translate_to_chars[f_count]
-                else:
-                    new_buf += c_input_str
-            f_count += 1
-    return new_buf
+    return input_str.translate(filter_table(filters, translate_to_chars))
+
+
+class FilterTable(dict):
+    """FilterTable is a str.translate table deleting the characters it does not map"""
+
+    def __missing__(self, key):
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def filter_table(filters, translate_to_chars):
+    """filter_table returns the FilterTable of filter_and_translator. Characters of filters
+    without equivalent in translate_to_chars are kept as is"""
+    table = FilterTable()
+    for f_count, c_filter in enumerate(filters):
+        c_translated = translate_to_chars[f_count] if f_count < len(translate_to_chars) else c_filter
+        table[ord(c_filter)] = table.get(ord(c_filter), '') + c_translated
+    # Spare the __missing__ call for ASCII characters
+    for code_point in range(128):
+        table.setdefault(code_point, None)
+    return table
+
+
+# Wide digits and letters are translated as their narrow equivalent in the same pass
+PHONE_TABLE = FilterTable(filter_table(PHONE_FILTER, PHONE_TRANSLATION))
+PHONE_TABLE.update({wide: PHONE_TABLE[narrow] for wide, narrow in NARROW_TABLE.items()
+                    if narrow in PHONE_TABLE})
 
 
 def parse_line(parsing_line):
     """parse_line is the base function for every single line
-    read by the program."""
-    newline = {}
-    for tpl in parsing_line.items():
-        key_tpl, value_tpl = tpl
+    read by the program. It runs ROW_PLAN over the list of fields and returns
+    the senate matching values in the parse_headers order, or None for an empty line.
+    Batches of lines go through parse_columns instead"""
+    row_plan = current_loader().row_plan
+    newline = [normalizer(parsing_line[pos]) for pos, _, normalizer, _ in row_plan]
+    if not any(newline):
+        return None
+    for count, (_, _, _, hasher) in enumerate(row_plan):
+        if hasher is not None and newline[count]:
+            newline[count] = hasher(newline[count:count + 1])[0]
+    return newline
 
-        if key_tpl not in MATCH:
-            continue
 
-        # Get the original properties from DATABANK_SENATE_MATCHING_MAPPING
-        databank_element = DATABANK_HEADERS[key_tpl]
-        field = databank_element['match']
-        norm_method = DATABANK_SENATE_MATCHING_MAPPING[field]['normalization']
-        normalized_element = normalize(value_tpl, norm_method)
+def line_columns(lines):
+    """line_columns returns the input columns of ROW_PLAN of a batch of lines,
+    lists of fields, by column index"""
+    columns = list(zip(*lines)) if lines else None
+    return {pos: columns[pos] if columns else [] for pos, _, _, _ in current_loader().row_plan}
 
-        if not normalized_element:
-            continue
 
-        # The primary key_tpl must not be hashed
-        match_key = MATCH[key_tpl]
-        if 'primary' in DATABANK_SENATE_MATCHING_MAPPING[field] \
-                and DATABANK_SENATE_MATCHING_MAPPING[field]['primary']:
-            newline[match_key] = normalized_element
-        else:
-            newline[match_key] = senate_hash(field, normalized_element)
-    return newline
+def parse_columns(columns):
+    """parse_columns runs ROW_PLAN column by column over columns, the values of the
+    input columns by index, and returns the senate matching values of the non empty
+    lines. Normalizers are looked up, and salts encoded, once per column"""
+    row_plan = current_loader().row_plan
+    with stage_timer('normalize'):
+        normalized = [list(map(normalizer, columns[pos])) for pos, _, normalizer, _ in row_plan]
+    with stage_timer('senate_hash'):
+        for column, (_, _, _, hasher) in zip(normalized, row_plan):
+            if hasher is not None:
+                column[:] = hasher(column)
+    return [line for line in zip(*normalized) if any(line)]
 
 
 def senate_hash(base_field, value):
     """senate_hash is hashing given field as the contributor node"""
-    # Do not hash fields that do not have salt. e.g. operation type
-    if not DATABANK_SENATE_MATCHING_MAPPING[base_field].get('salt', False):
+    mapping = current_loader().mapping
+    # Fields declared without salt are sent as is. e.g. operation type
+    if mapping[base_field].get('salt') is False:
+        return value
+    # Never send the value of a field whose salt is unknown
+    if not mapping[base_field].get('salt', False):
         return base_field
-    salt = DATABANK_SENATE_MATCHING_MAPPING[base_field]['salt']
+    salt = mapping[base_field]['salt']
     hsh = hashlib.sha512((value + salt).encode('utf-8'))
     return base64.b64encode(hsh.digest()).decode('utf-8')
 
 
+def field_salts():
+    """field_salts returns the salts injected by retrieve_salts, per field"""
+    mapping = current_loader().mapping
+    return {field: mapping[field]['salt'] for field in mapping if 'salt' in mapping[field]}
+
+
+def init_hash_worker(spec, mapping, hash_cache_megabytes, stats_enabled=False, hashed_input=False):
+    """init_hash_worker sets up the hash cache, stats and ROW_PLAN of a hashing process.
+    The process works for a Loader of mapping, the mapping and salts of the Loader that
+    started it, so that its digests are the ones of an in-process load"""
+    global STATS
+    loader = Loader(mapping)
+    CURRENT_LOADER.set(loader)
+    loader.hashed_input = hashed_input
+    configure_hash_cache(hash_cache_megabytes)
+    STATS = Stats() if stats_enabled else None
+    loader.row_plan[:] = compile_row_plan(spec)
+
+
+def hash_batch(batch):
+    """hash_batch runs parse_line over a batch of lines and returns the CSV text
+    of the non empty ones"""
+    if isinstance(batch, ColumnBlock):
+        return hash_columns(batch.columns, batch.row_count)
+    if isinstance(batch, MappedBlock):
+        with stage_timer('read_csv'):
+            batch = batch.rows()
+    return hash_columns(line_columns(batch), len(batch))
+
+
+def hash_columns(columns, row_count):
+    """hash_columns runs parse_columns over columns, the values of the input columns
+    by index, and returns the CSV text of the non empty lines"""
+    lines = parse_columns(columns)
+    with stage_timer('csv_encode'):
+        buf = io.StringIO()
+        csv.writer(buf).writerows(lines)
+    if STATS is not None:
+        STATS.add('rows_read', row_count)
+        STATS.add('rows_hashed', len(lines))
+        STATS.add('rows_dropped_empty', row_count - len(lines))
+    return buf.getvalue()
+
+
+def hash_worker_batch(batch):
+    """hash_worker_batch is hash_batch for a worker process. It also returns
+    the hash cache hits and misses and the stats of the batch"""
+    hits, misses = hash_cache_counters()
+    hashed_batch = hash_batch(batch)
+    new_hits, new_misses = hash_cache_counters()
+    stats = STATS.take() if STATS is not None else None
+    return hashed_batch, new_hits - hits, new_misses - misses, stats
+
+
+def iter_batches(iterator, batch_rows=None, stage='read_csv'):
+    """iter_batches groups the lines of iterator in lists of batch_rows lines,
+    BATCH_ROWS by default, the time taken by iterator being timed under stage unless
+    None. A MappedCSV gives MappedBlock batches instead, and an ArrowReader ColumnBlock
+    batches"""
+    batch_rows = batch_rows or BATCH_ROWS
+    if isinstance(iterator, (MappedCSV, ArrowReader)):
+        yield from iterator.batches(batch_rows)
+        return
+    while True:
+        with stage_timer(stage) if stage is not None else NO_STATS_TIMER:
+            batch = list(itertools.islice(iterator, batch_rows))
+        if not batch:
+            return
+        yield batch
+
+
+def hash_batches(iterator, headers, workers=1, batch_rows=None):
+    """hash_batches yields the CSV text of every batch of iterator, in input order.
+    With more than one worker, batches are hashed by a pool of processes"""
+    batches = prefetch(iter_batches(iterator, batch_rows), PIPELINE_QUEUE_BATCHES)
+    if workers <= 1:
+        for batch in batches:
+            yield hash_batch(batch)
+            if STATS is not None:
+                STATS.progress()
+        return
+
+    loader = current_loader()
+
+    def collect(future):
+        hashed_batch, hits, misses, stats = future.result()
+        loader.hash_cache_worker_counters['hits'] += hits
+        loader.hash_cache_worker_counters['misses'] += misses
+        if STATS is not None:
+            STATS.merge(stats)
+            STATS.progress()
+        return hashed_batch
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=init_hash_worker,
+            initargs=(row_plan_spec(headers), loader.mapping, loader.hash_cache_megabytes,
+                      STATS is not None, loader.hashed_input)) as pool:
+        # Bounded number of batches in flight to keep memory flat on large files
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(pool.submit(hash_worker_batch, batch))
+            if len(pending) >= workers * 2:
+                yield collect(pending.popleft())
+        while pending:
+            yield collect(pending.popleft())
+
+
+def prefetch(iterable, maxsize):
+    """prefetch is the reader stage of the pipeline: it runs iterable on a thread, at most
+    maxsize elements ahead of the consumer. Exceptions, including exit(), are raised
+    again on the consumer side"""
+    elements = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(element, error=None):
+        while not stop.is_set():
+            try:
+                elements.put((element, error), timeout=PIPELINE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for element in iterable:
+                if not put(element):
+                    return
+            put(PIPELINE_END)
+        except BaseException as ex:
+            put(None, ex)
+
+    threading.Thread(target=in_current_context(produce), daemon=True).start()
+    try:
+        while True:
+            element, error = elements.get()
+            if error is not None:
+                raise error
+            if element is PIPELINE_END:
+                return
+            yield element
+    finally:
+        # Let the reader go when the consumer stops early
+        stop.set()
+
+
+class BackgroundWriter:
+    """BackgroundWriter is the writer stage of the pipeline: data given to write is written
+    by a thread, in order, with at most maxsize pending writes"""
+
+    def __init__(self, write, maxsize):
+        self.pending = queue.Queue(maxsize)
+        self.error = None
+        self.thread = threading.Thread(target=in_current_context(self.consume), args=(write,),
+                                       daemon=True)
+        self.thread.start()
+
+    def consume(self, write):
+        while True:
+            data = self.pending.get()
+            if data is PIPELINE_END:
+                return
+            if self.error is None:
+                try:
+                    write(data)
+                except BaseException as ex:
+                    self.error = ex
+
+    def write(self, data):
+        """write queues data, raising the error of a previous write if any"""
+        if self.error is not None:
+            raise self.error
+        self.pending.put(data)
+
+    def close(self):
+        """close waits for the pending writes"""
+        self.pending.put(PIPELINE_END)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+def column_hasher(base_field):
+    """column_hasher returns senate_hash_column for base_field with the salt looked up once.
+    Only the fields declared with hash_cache, whose values repeat, go through the hash cache"""
+    mapping = current_loader().mapping[base_field]
+    salt = mapping.get('salt', False)
+    if not salt:
+        return lambda values: [base_field if value else value for value in values]
+    return functools.partial(hash_column, salt=salt.encode('utf-8'),
+                             cached=mapping.get('hash_cache', False))
+
+
+def normalize_column(values, normalization_method):
+    """normalize_column is normalize over a list of values, the normalization method
+    being looked up once"""
+    return list(map(NORMALIZERS.get(normalization_method, normalize_str), values))
+
+
+def senate_hash_column(base_field, values):
+    """senate_hash_column is senate_hash over a list of normalized values of base_field,
+    the salt being looked up and encoded once. As in parse_line, empty values are not
+    hashed and stay empty"""
+    if current_loader().mapping[base_field].get('salt') is False:
+        return list(values)
+    return column_hasher(base_field)(values)
+
+
+def check_digest_column(base_field, values):
+    """check_digest_column is the column hasher of the --hashed input. Values of base_field
+    must be empty or a base64 SHA-512 digest, and are kept as is"""
+    fullmatch = DIGEST_PATTERN.fullmatch
+    for value in values:
+        if value and fullmatch(value) is None:
+            # The value could be plain personal information, it is not logged
+            logger.error('Error: [{}] values must be empty or hashed (88 characters of base64), '
+                         'found a value of {} characters'.format(base_field, len(value)))
+            raise InvalidLineError
+    return values
+
+
+def hash_column(values, salt, cached=False):
+    """hash_column returns the base64 SHA-512 digests of values followed by the salt bytes,
+    through the hash cache of the current loader when cached and enabled. Mostly unique
+    values are hashed faster without it. Empty values stay empty"""
+    digest = current_loader().hash_cache if cached else None
+    if digest is not None:
+        return [digest(value, salt) if value else value for value in values]
+    sha512 = hashlib.sha512
+    b64encode = base64.b64encode
+    return [b64encode(sha512(value.encode('utf-8') + salt).digest()).decode('ascii')
+            if value else value for value in values]
+
+
+def salted_hash(value, salt):
+    """salted_hash returns the base64 SHA-512 digest of value followed by the salt bytes"""
+    return base64.b64encode(hashlib.sha512(value.encode('utf-8') + salt).digest()).decode('utf-8')
+
+
+def configure_hash_cache(max_megabytes):
+    """configure_hash_cache memoizes salted_hash in a LRU cache of at most max_megabytes,
+    for the current loader. The salt being per field, the cache is keyed by field and
+    normalized value. 0 disables the cache"""
+    loader = current_loader()
+    loader.hash_cache_megabytes = max_megabytes
+    entries = int(max_megabytes * 1024 * 1024) // HASH_CACHE_ENTRY_BYTES
+    loader.hash_cache = functools.lru_cache(maxsize=entries)(salted_hash) if entries else None
+    loader.hash_cache_worker_counters = {'hits': 0, 'misses': 0}
+
+
+def hash_cache_counters():
+    """hash_cache_counters returns the hits and misses of the hash cache of the current
+    loader, including the ones of the worker processes"""
+    loader = current_loader()
+    hits = loader.hash_cache_worker_counters['hits']
+    misses = loader.hash_cache_worker_counters['misses']
+    if loader.hash_cache is not None:
+        info = loader.hash_cache.cache_info()
+        hits += info.hits
+        misses += info.misses
+    return hits, misses
+
+
+def report_hash_cache():
+    """report_hash_cache prints the hash cache counters of the current loader on stderr"""
+    if current_loader().hash_cache is None:
+        return
+    hits, misses = hash_cache_counters()
+    hit_rate = hits / (hits + misses) if hits + misses else 0
+    print('Hash cache: {} hits, {} misses ({:.1%} hit rate)'.format(hits, misses, hit_rate),
+          file=sys.stderr)
+
+
+class Stats:
+    """Stats collects the wall time of every stage of a run and its counters for --stats.
+    Times are in seconds and sizes in bytes. It prints a progress line every
+    progress_seconds and the JSON summary of the run on stderr"""
+
+    def __init__(self, progress_seconds=STATS_PROGRESS_SECONDS):
+        self.counters = collections.Counter()
+        self.maxima = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.progress_seconds = progress_seconds
+        self.last_progress = self.started
+
+    def add(self, name, value=1):
+        """add adds value to the name counter"""
+        with self.lock:
+            self.counters[name] += value
+
+    def maximum(self, name, value):
+        """maximum keeps the largest value seen for name"""
+        with self.lock:
+            self.maxima[name] = max(self.maxima.get(name, value), value)
+
+    def take(self):
+        """take returns the counters collected so far and resets them"""
+        with self.lock:
+            counters, self.counters = self.counters, collections.Counter()
+        return counters
+
+    def merge(self, counters):
+        """merge adds the counters taken from another process"""
+        with self.lock:
+            self.counters.update(counters)
+
+    def counted_readline(self, readline):
+        """counted_readline wraps readline to count the bytes read"""
+        def counted():
+            line = readline()
+            self.add('bytes_read', len(line.encode('utf-8')))
+            return line
+        return counted
+
+    def counted_chunks(self, chunks, name):
+        """counted_chunks counts the bytes of chunks under name"""
+        for chunk in chunks:
+            self.add(name, len(chunk))
+            yield chunk
+
+    def progress(self):
+        """progress prints a progress line when progress_seconds passed since the last one"""
+        now = time.perf_counter()
+        if now - self.last_progress < self.progress_seconds:
+            return
+        self.last_progress = now
+        elapsed = now - self.started
+        print('Progress: {:.0f}s, {} rows read ({:.0f} rows/s), {} rows hashed, {} bytes written'.format(
+            elapsed, self.counters['rows_read'], self.counters['rows_read'] / elapsed,
+            self.counters['rows_hashed'], self.counters['bytes_written']), file=sys.stderr)
+
+    def summary(self):
+        """summary returns the stages and counters of the run"""
+        wall_seconds = time.perf_counter() - self.started
+        stages = {}
+        counters = {}
+        for name, value in sorted(self.counters.items()):
+            if name.endswith('_seconds') and not name.endswith('_latency_seconds'):
+                stages[name[:-len('_seconds')]] = round(value, 4)
+            else:
+                counters[name] = round(value, 4) if isinstance(value, float) else value
+        counters.update((name, round(value, 4)) for name, value in self.maxima.items())
+        if wall_seconds and self.counters['rows_read']:
+            counters['rows_per_second'] = round(self.counters['rows_read'] / wall_seconds)
+        return {'wall_seconds': round(wall_seconds, 4), 'stages_seconds': stages,
+                'counters': counters}
+
+    def report(self):
+        """report prints the JSON summary on stderr"""
+        print(json.dumps(self.summary(), sort_keys=True), file=sys.stderr)
+
+
+def stage_timer(stage, latency=False):
+    """stage_timer times the with block under stage when --stats is enabled.
+    With latency, the longest block is also kept as the stage max latency"""
+    if STATS is None:
+        return NO_STATS_TIMER
+    return timed_stage(stage, latency)
+
+
+@contextlib.contextmanager
+def timed_stage(stage, latency):
+    """timed_stage is the stage_timer context manager"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STATS.add(stage + '_seconds', elapsed)
+        if latency:
+            STATS.maximum(stage + '_max_latency_seconds', elapsed)
+
+
+def enable_stats(progress_seconds=STATS_PROGRESS_SECONDS):
+    """enable_stats starts collecting stats and prints their summary on exit"""
+    global STATS
+    STATS = Stats(progress_seconds)
+    atexit.register(STATS.report)
+    return STATS
+
+
 def validate_env():
     """validate_env validates the environment variables to make sure the request
     to Contributor node will be possible after the data has been processed"""
@@ -418,10 +1509,21 @@ def validate_env():
             exit(3)
 
 
+def open_hitch_buf(mode):
+    """open_hitch_buf opens the buffer file of the current loader, gzip compressed when
+    BUFFER_COMPRESSION is set"""
+    loader = current_loader()
+    encoding = 'UTF8' if 't' in mode else None
+    if loader.buffer_compression:
+        return gzip.open(loader.buf_filename, mode, compresslevel=BUFFER_COMPRESSLEVEL,
+                         encoding=encoding)
+    return open(loader.buf_filename, mode, encoding=encoding, buffering=WRITE_BUFFER_BYTES)
+
+
 def clean_buf_env():
     """clean_buf_env makes sure the buffer file does not exists"""
     try:
-        os.remove(HITCH_BUF_FILENAME)
+        os.remove(current_loader().buf_filename)
     except IOError:
         pass
 
@@ -437,31 +1539,82 @@ def hitch_contributor_node_url(hcn=None):
     return 'https://{}/api/Contributor/v1/'.format(hcn)
 
 
-def generate_hitch_csv(iterator):
-    """generate_hitch_csv reads from iterator and writes to temporary buffer"""
+def generate_hitch_csv(iterator, workers=1, uploader=None, delta=None):
+    """generate_hitch_csv reads from iterator and writes to temporary buffer.
+    The first element of iterator is the header row, as yielded by read_csv.
+    With an uploader, hashed lines are uploaded by chunks instead. With a delta
+    index, only the lines changed since the last load are kept"""
+    if uploader is not None:
+        return upload_hitch_chunks(iterator, uploader, workers, delta)
+
     # Use of a tempoary file to avoid storing the entire file in memory
-    parsed_headers = False
     clean_buf_env()
 
-    with open(HITCH_BUF_FILENAME, 'wt', encoding='UTF8') as hitch_buf_fd:
-        for raw_line in iterator:
+    with open_hitch_buf('wt') as hitch_buf_fd:
+        try:
             # One time header parse
-            if not parsed_headers:
-                try:
-                    writer = csv.DictWriter(hitch_buf_fd, fieldnames=parse_headers(raw_line.keys()))
-                    writer.writeheader()
-                except InvalidFileHeadersError:
-                    clean_buf_env()
-                    return False
-                parsed_headers = True
-
+            headers = next(iterator)
+            writer = csv.writer(hitch_buf_fd)
+            fieldnames = parse_headers(headers)
+            if delta is not None:
+                fieldnames = delta.start(fieldnames)
+            writer.writerow(fieldnames)
+        except StopIteration:
+            return True
+        except InvalidFileHeadersError:
+            clean_buf_env()
+            return False
+
+        def write(hashed_batch):
+            with stage_timer('write'):
+                hitch_buf_fd.write(hashed_batch)
+            if STATS is not None:
+                STATS.add('bytes_written', len(hashed_batch.encode('utf-8')))
+
+        buf_writer = BackgroundWriter(write, PIPELINE_QUEUE_BATCHES)
+        try:
             try:
-                parsed_line = parse_line(raw_line)
-            except InvalidLineError:
-                clean_buf_env()
-                return False
-            if parsed_line:
-                writer.writerow(parsed_line)
+                hashed_batches = hash_batches(iterator, headers, workers)
+                if delta is not None:
+                    hashed_batches = delta.filter_batches(hashed_batches)
+                for hashed_batch in hashed_batches:
+                    buf_writer.write(hashed_batch)
+            finally:
+                buf_writer.close()
+        except (InvalidLineError, InvalidFileHeadersError):
+            clean_buf_env()
+            return False
+    return True
+
+
+def upload_hitch_chunks(iterator, uploader, workers=1, delta=None):
+    """upload_hitch_chunks hashes iterator as generate_hitch_csv does and hands
+    every uploader.chunk_rows lines over to uploader while hashing goes on"""
+    try:
+        headers = next(iterator)
+        fieldnames = parse_headers(headers)
+        if delta is not None:
+            fieldnames = delta.start(fieldnames)
+        uploader.writeheader(fieldnames)
+    except StopIteration:
+        return True
+    except InvalidFileHeadersError:
+        uploader.abort()
+        return False
+
+    try:
+        # Lines of the chunks accepted by a previous run are neither normalized nor hashed
+        skip_lines(iterator, uploader.resume())
+        hashed_batches = hash_batches(iterator, headers, workers, uploader.chunk_rows)
+        if delta is not None:
+            hashed_batches = delta.filter_batches(hashed_batches)
+        for hashed_batch in hashed_batches:
+            # Stop hashing as soon as the Contributor Node rejected a chunk
+            if not uploader.write(hashed_batch):
+                break
+    except (InvalidLineError, InvalidFileHeadersError):
+        uploader.abort()
+        return False
     return True
 
 
@@ -470,11 +1623,11 @@ def contributor_loaded_tokens(hostname, dbuuid, static_auth, ca_verify=True):
 
     params = {'DBUUID': dbuuid}
     try:
-        token_req = requests.get(hostname + 'GetPersonTokens',
-                                 params=params,
-                                 auth=static_auth,
-                                 headers={'accept': 'application/json'},
-                                 verify=ca_verify)
+        token_req = shared_transport().get(hostname + 'GetPersonTokens',
+                                           params=params,
+                                           auth=static_auth,
+                                           headers={'accept': 'application/json'},
+                                           verify=ca_verify)
         token_req.raise_for_status()
         token_json = token_req.json()
         if not token_json:
@@ -485,7 +1638,7 @@ def contributor_loaded_tokens(hostname, dbuuid, static_auth, ca_verify=True):
                "by either using your system's trusted CAs with "
                "REQUESTS_CA_BUNDLE or set REQUESTS_CA_VERIFY to false")
         return [], False
-    except requests.exceptions.ConnectionError:
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         logger.error('Error: contributor node is unreachable')
         return [], False
     except requests.HTTPError as ex:
@@ -497,100 +1650,1193 @@ def contributor_loaded_tokens(hostname, dbuuid, static_auth, ca_verify=True):
         return [], False
 
 
+def stream_loaded_tokens(hostname, dbuuid, static_auth, output, ca_verify=True,
+                         output_format='csv'):
+    """stream_loaded_tokens writes the personid,token mapping to output while it is
+    downloaded from GetPersonTokens, without holding the whole token list in memory.
+    With the parquet output_format, output is the name of the Parquet file.
+    Returns the number of tokens written and the success of the download"""
+
+    params = {'DBUUID': dbuuid}
+    count = 0
+    try:
+        with stage_timer('get_person_tokens'), \
+                shared_transport().get(hostname + 'GetPersonTokens',
+                                       params=params,
+                                       auth=static_auth,
+                                       headers={'accept': 'application/json'},
+                                       verify=ca_verify,
+                                       stream=True) as token_req:
+            if STATS is not None:
+                STATS.add('get_person_tokens_latency_seconds', token_req.elapsed.total_seconds())
+            token_req.raise_for_status()
+            chunks = token_req.iter_content(chunk_size=TOKENS_CHUNK_BYTES)
+            if STATS is not None:
+                chunks = STATS.counted_chunks(chunks, 'get_person_tokens_bytes')
+            tokens = iter_json_array(chunks)
+            first_token = next(tokens, None)
+            if first_token is None:
+                logger.error('Error: no loaded tokens found after load')
+                return 0, True
+            write = write_output_parquet if output_format == 'parquet' else write_output
+            count = write(output, itertools.chain([first_token], tokens))
+            if STATS is not None:
+                STATS.add('tokens_written', count)
+        return count, True
+    except requests.exceptions.SSLError:
+        logger.error("Error: Invalid certificate. Update your environment variables "
+               "by either using your system's trusted CAs with "
+               "REQUESTS_CA_BUNDLE or set REQUESTS_CA_VERIFY to false")
+        return count, False
+    except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.Timeout):
+        logger.error('Error: contributor node is unreachable')
+        return count, False
+    except requests.HTTPError as ex:
+        logger.error(ex)
+        logger.error('Error {}: {}'.format(token_req.status_code, token_req.text.rstrip()))
+        return count, False
+    except (ValueError, KeyError, TypeError):
+        logger.error('Error: error decoding the response')
+        return count, False
+
+
+def iter_json_array(chunks):
+    """iter_json_array yields the elements of a JSON array received as
+    a sequence of UTF-8 encoded chunks, decoding each element once complete"""
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    buf = ''
+    pos = 0
+    in_array = False
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            buf = buf[pos:] + utf8_decoder.decode(b'', final=True)
+        else:
+            buf = buf[pos:] + utf8_decoder.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buf):
+                break
+            if not in_array:
+                if buf[pos] != '[':
+                    raise ValueError('Expecting a JSON array')
+                in_array = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if chunk is None:
+                    raise
+                # Incomplete element, wait for the next chunk
+                break
+            if end == len(buf) and chunk is not None:
+                # A number could go on in the next chunk
+                break
+            pos = end
+            yield element
+    raise ValueError('Unterminated JSON array')
+
+
 def write_output(output, tokens):
-    """write_output writes on the specified output the resulting CSV"""
+    """write_output writes on the specified output the resulting CSV, by batches of
+    OUTPUT_BATCH_ROWS lines. Returns the number of lines written. The download of the
+    tokens is timed by stream_loaded_tokens"""
+    count = 0
     if output == sys.stdout:
-        print('personid,token')
-        for row in tokens:
-            print('{},{}'.format(row['PersonId'], row['Token']))
-        return
+        output.write('personid,token\n')
+        for batch in iter_batches(iter(tokens), OUTPUT_BATCH_ROWS, stage=None):
+            output.writelines(['{},{}\n'.format(row['PersonId'], row['Token']) for row in batch])
+            count += len(batch)
+        return count
 
     csvwriter = csv.writer(output, skipinitialspace=True,
                            delimiter=',', quoting=csv.QUOTE_NONE)
     csvwriter.writerow(['personid', 'token'])
-    for row in tokens:
-        csvwriter.writerow([row['PersonId'], row['Token']])
-
-def load_hashed_records(host, dbuuid, auth, ca_verify=True, hashedFile=''):
-    """load_hashed_records() loads the data and return the token/id mapping"""
-
+    for batch in iter_batches(iter(tokens), OUTPUT_BATCH_ROWS, stage=None):
+        csvwriter.writerows([[row['PersonId'], row['Token']] for row in batch])
+        count += len(batch)
+    return count
+
+def compress_body(body, encoding):
+    """compress_body returns body compressed for the encoding Content-Encoding"""
+    if encoding == 'zstd':
+        load_zstandard()
+        return zstandard.ZstdCompressor(level=UPLOAD_COMPRESSION_LEVELS['zstd']).compress(body)
+    return gzip.compress(body, compresslevel=UPLOAD_COMPRESSION_LEVELS['gzip'])
+
+
+def compress_stream(chunks, encoding):
+    """compress_stream yields the chunks of bytes compressed for the encoding Content-Encoding"""
+    if encoding == 'zstd':
+        load_zstandard()
+        compressor = zstandard.ZstdCompressor(level=UPLOAD_COMPRESSION_LEVELS['zstd']).compressobj()
+    else:
+        # gzip container
+        compressor = zlib.compressobj(UPLOAD_COMPRESSION_LEVELS['gzip'], zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            if STATS is not None:
+                STATS.add('upload_bytes_compressed', len(compressed))
+            yield compressed
+    compressed = compressor.flush()
+    if STATS is not None:
+        STATS.add('upload_bytes_compressed', len(compressed))
+    yield compressed
+
+
+def multipart_stream(filename, chunks, boundary):
+    """multipart_stream yields the multipart/form-data body of a single text/csv file field
+    holding the chunks of bytes, as requests files= would encode it"""
+    yield ('--{}\r\nContent-Disposition: form-data; name="file"; filename="{}"\r\n'
+           'Content-Type: text/csv\r\n\r\n'.format(boundary, filename)).encode('utf-8')
+    yield from chunks
+    yield '\r\n--{}--\r\n'.format(boundary).encode('utf-8')
+
+
+def send_hashed_records(session, prepared, ca_verify):
+    """send_hashed_records sends the prepared LoadHashedRecords request, with its body
+    compressed as UPLOAD_COMPRESSION. Plain uploads are used from then on if the
+    Contributor Node rejects a compressed one. A streamed body cannot be sent again"""
+    loader = current_loader()
+    encoding = loader.upload_compression
+    if encoding is None:
+        return session.send(prepared, verify=ca_verify)
+
+    compressed = prepared.copy()
+    compressed.headers['Content-Encoding'] = encoding
+    if isinstance(prepared.body, bytes):
+        compressed.body = compress_body(prepared.body, encoding)
+        compressed.headers['Content-Length'] = str(len(compressed.body))
+        if STATS is not None:
+            STATS.add('upload_bytes_compressed', len(compressed.body))
+    else:
+        compressed.body = compress_stream(prepared.body, encoding)
+    load_req = session.send(compressed, verify=ca_verify)
+    if load_req.status_code not in UPLOAD_COMPRESSION_REJECTED_STATUSES:
+        return load_req
+    if not isinstance(prepared.body, bytes):
+        logger.error('Error: contributor node rejected {} uploads ({}), run again without '
+                     '--compress'.format(encoding, load_req.status_code))
+        return load_req
+    if loader.upload_compression is not None:
+        loader.upload_compression = None
+        logger.warning('Warning: contributor node rejected {} uploads ({}), '
+                       'uploading plain files instead'.format(encoding, load_req.status_code))
+    return session.send(prepared, verify=ca_verify)
+
+
+def write_output_parquet(filename, tokens):
+    """write_output_parquet is write_output for a Parquet mapping file"""
+    load_pyarrow()
+    schema = pyarrow.schema([('personid', pyarrow.string()), ('token', pyarrow.string())])
+    count = 0
+    with pyarrow.parquet.ParquetWriter(filename, schema) as writer:
+        for batch in iter_batches(iter(tokens), OUTPUT_BATCH_ROWS, stage=None):
+            writer.write_table(pyarrow.table({'personid': [str(row['PersonId']) for row in batch],
+                                              'token': [row['Token'] for row in batch]},
+                                             schema=schema))
+            count += len(batch)
+    return count
+
+
+def write_hashed_parquet(filename):
+    """write_hashed_parquet copies the buffer file of hashed lines to filename as Parquet,
+    every column being a string"""
+    load_pyarrow()
+    with open_hitch_buf('rt') as hitch_buf_fd:
+        fieldnames = next(csv.reader(hitch_buf_fd), [])
+    loader = current_loader()
+    source = pyarrow.input_stream(loader.buf_filename,
+                                  compression='gzip' if loader.buffer_compression else None)
+    convert_options = pyarrow.csv.ConvertOptions(
+        column_types={name: pyarrow.string() for name in fieldnames}, strings_can_be_null=False)
+    with source, pyarrow.csv.open_csv(source, convert_options=convert_options) as reader, \
+            pyarrow.parquet.ParquetWriter(filename, reader.schema) as writer:
+        for record_batch in reader:
+            writer.write_table(pyarrow.Table.from_batches([record_batch]))
+
+
+def post_hashed_records(session, host, dbuuid, auth, ca_verify, filename, payload):
+    """post_hashed_records posts payload to LoadHashedRecords through session, a Transport,
+    and returns the status code. payload is either bytes, a file or an iterable of bytes
+    streamed as they come. Errors are logged, and reported as 500 when the Contributor
+    Node did not answer"""
     params = {'DBUUID': dbuuid}
-    src = HITCH_BUF_FILENAME if hashedFile == '' else hashedFile
+    if STATS is not None:
+        STATS.add('upload_requests')
+        if isinstance(payload, bytes):
+            STATS.add('upload_bytes', len(payload))
+        elif hasattr(payload, 'fileno'):
+            STATS.add('upload_bytes', os.fstat(payload.fileno()).st_size)
     try:
-        load_req = requests.post(host + 'LoadHashedRecords', params=params,
-                                 auth=auth,
-                                 files={'file': (UPLOAD_FILENAME, open(src, 'rb'),
-                                                 'text/csv')},
-                                 verify=ca_verify)
+        with stage_timer('load_hashed_records', latency=True):
+            if isinstance(payload, bytes) or hasattr(payload, 'fileno'):
+                prepared = session.prepare('POST', host + 'LoadHashedRecords', params=params,
+                                           auth=auth,
+                                           files={'file': (filename, payload, 'text/csv')})
+            else:
+                # Iterable of bytes, sent with chunked transfer encoding
+                boundary = os.urandom(16).hex()
+                prepared = session.prepare('POST', host + 'LoadHashedRecords', params=params,
+                                           auth=auth,
+                                           data=multipart_stream(filename, payload, boundary),
+                                           headers={'Content-Type': 'multipart/form-data; '
+                                                                    'boundary=' + boundary})
+            load_req = send_hashed_records(session, prepared, ca_verify)
         load_req.raise_for_status()
     except requests.exceptions.SSLError:
         logger.error("Error: Invalid certificate. Update your environment variables "
                "by either using your system's trusted CAs with "
                "REQUESTS_CA_BUNDLE or set REQUESTS_CA_VERIFY to false")
-    except requests.exceptions.ConnectionError:
+        return 500
+    except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
         logger.error('Error: contributor node is unreachable')
+        return 500
     except requests.HTTPError:
         try:
             format_error = load_req.json()
             logger.error('Error {}: {} ({})'.format(load_req.status_code, format_error['error'], format_error['code']))
         except:
             logger.error('Error {}: {}'.format(load_req.status_code, load_req.text.rstrip()))
-    except OverflowError as e:
+    return load_req.status_code
+
+
+def load_hashed_records(host, dbuuid, auth, ca_verify=True, hashedFile='', parallel_uploads=4):
+    """load_hashed_records() loads the data and return the token/id mapping.
+    Files larger than UPLOAD_SIZE_LIMIT are uploaded by chunks, see upload_file_chunks"""
+
+    loader = current_loader()
+    src = loader.buf_filename if hashedFile == '' else hashedFile
+    try:
+        if hashedFile == '' and loader.buffer_compression:
+            # Uploaded uncompressed, unless UPLOAD_COMPRESSION says otherwise. The uncompressed
+            # size is only known once the buffer has been read through
+            with open_hitch_buf('rb') as hitch_buf_fd:
+                if read_size(hitch_buf_fd, UPLOAD_SIZE_LIMIT) > UPLOAD_SIZE_LIMIT:
+                    return upload_file_chunks(host, dbuuid, auth, ca_verify, hitch_buf_fd,
+                                              parallel_uploads)
+                return post_hashed_records(shared_transport(), host, dbuuid, auth, ca_verify,
+                                           loader.upload_filename, hitch_buf_fd.read())
+        with open(src, 'rb') as payload:
+            if os.fstat(payload.fileno()).st_size > UPLOAD_SIZE_LIMIT:
+                return upload_file_chunks(host, dbuuid, auth, ca_verify, payload,
+                                          parallel_uploads)
+            return post_hashed_records(shared_transport(), host, dbuuid, auth, ca_verify,
+                                       loader.upload_filename, payload)
+    except OverflowError:
         statinfo = os.stat(src)
-        logger.error('Error: File size {:3d} GB is too large', statinfo.st_size / ( 1024 * 1024 * 1024 )) # bytes to GB
+        logger.error('Error: File size {:.1f} GB is too large'.format(
+            statinfo.st_size / (1024 * 1024 * 1024)))  # bytes to GB
+        return 500
     finally:
         clean_buf_env()
-        if 'load_req' in locals():
-            return load_req.status_code
-        return 500
 
-def get_chunk_file_list(filename, delimiter=","):
-    fileList = []
-    # Check the file size and split it to 50k line chunks if it's larger than single file size limit
-    singleFileSizeLimit = 2 * 1024  * 1024 * 1024 
-    statinfo = os.stat(filename)
-    if statinfo.st_size > singleFileSizeLimit :
-        chunkFolder = "chunks"
+
+def read_size(hashed_fd, limit):
+    """read_size returns the size of the file hashed_fd, read until its end or until it is
+    larger than limit, and rewinds it"""
+    size = 0
+    while size <= limit:
+        block = hashed_fd.read(WRITE_BUFFER_BYTES)
+        if not block:
+            break
+        size += len(block)
+    hashed_fd.seek(0)
+    return size
+
+
+def split_rows(hashed_fd, chunk_bytes):
+    """split_rows reads the lines of the CSV file hashed_fd, opened in binary mode, by blocks
+    of about chunk_bytes and yields them cut at the last line boundary of every block.
+    Newlines inside double quoted fields are not line boundaries"""
+    rest = b''
+    while True:
+        block = hashed_fd.read(chunk_bytes)
+        if not block:
+            break
+        data = rest + block if rest else block
+        # data starts at a line boundary: a newline is one when an even number of quotes
+        # precedes it
+        quotes = data.count(b'"')
+        end = data.rfind(b'\n')
+        while end >= 0 and (quotes - data.count(b'"', end)) % 2:
+            end = data.rfind(b'\n', 0, end)
+        if end < 0:
+            rest = data
+            continue
+        yield data[:end + 1]
+        rest = data[end + 1:]
+    if rest:
+        yield rest
+
+
+def upload_file_chunks(host, dbuuid, auth, ca_verify, hashed_fd, parallel_uploads=4):
+    """upload_file_chunks uploads the hashed CSV file hashed_fd, opened in binary mode, by
+    chunks of about UPLOAD_CHUNK_BYTES, parallel_uploads at a time, and returns the worst
+    status code. Chunks are byte ranges of the file cut at line boundaries, no chunk file
+    is written. A file fitting in a single chunk is uploaded in a single request"""
+    header = hashed_fd.readline()
+    chunks = split_rows(hashed_fd, UPLOAD_CHUNK_BYTES)
+    first = next(chunks, b'')
+    second = next(chunks, None)
+    if second is None:
+        return post_hashed_records(shared_transport(), host, dbuuid, auth, ca_verify,
+                                   current_loader().upload_filename, header + first)
+    uploader = ChunkUploader(host, dbuuid, auth, ca_verify, None, parallel_uploads)
+    uploader.writeheader(next(csv.reader([header.decode('utf-8')])))
+    for chunk in itertools.chain([first, second], chunks):
+        # Stop reading as soon as the Contributor Node rejected a chunk
+        if not uploader.write(chunk):
+            break
+    return uploader.close()
+
+
+async def load_hashed_files(host, dbuuid, auth, ca_verify, filenames, async_transport=None):
+    """load_hashed_files uploads the hashed CSV filenames to LoadHashedRecords concurrently
+    and returns their status codes, in order"""
+    own_transport = async_transport is None
+    if own_transport:
+        async_transport = AsyncTransport()
+
+    def post_file(filename):
+        with open(filename, 'rb') as payload:
+            return post_hashed_records(async_transport.transport, host, dbuuid, auth, ca_verify,
+                                       os.path.basename(filename), payload)
+    try:
+        return await asyncio.gather(*[async_transport.run(post_file, filename)
+                                      for filename in filenames])
+    finally:
+        if own_transport:
+            async_transport.close()
+
+
+class LoadManifest:
+    """LoadManifest checkpoints a chunked load in a JSON lines file: the identity of the load,
+    then a line per uploaded chunk with its input lines, SHA-256 and upload status. A failed
+    load can then be resumed from its first rejected chunk, as long as the input, DBUUID and
+    chunk size are the same. A chunk recorded twice keeps its last status"""
+
+    def __init__(self, filename, identity):
+        self.filename = filename
+        self.identity = identity
+        self.chunks = {}
+        # Whether filename holds this manifest, chunks being then appended to it
+        self.saved = False
+
+    @classmethod
+    def load(cls, filename, identity):
+        """load returns the manifest saved in filename if it was made for identity,
+        or a new manifest otherwise"""
+        manifest = cls(filename, identity)
+        try:
+            with open(filename, 'rt', encoding='UTF-8') as manifest_fd:
+                lines = manifest_fd.read().splitlines()
+            saved = json.loads(lines[0]) if lines else {}
+        except (IOError, ValueError):
+            return manifest
+        if saved.get('identity') != identity:
+            logger.warning('Warning: {} was made for another load and is ignored'.format(filename))
+            return manifest
+        for line in lines[1:]:
+            try:
+                chunk = json.loads(line)
+            except ValueError:
+                # Line cut short by an interrupted load
+                continue
+            manifest.chunks[chunk.pop('index')] = chunk
+        manifest.save()
+        return manifest
+
+    def accepted(self, index, digest=None):
+        """accepted tells if the Contributor Node accepted the chunk. With a digest,
+        the chunk must also be the same as the one uploaded"""
+        chunk = self.chunks.get(index)
+        if chunk is None or chunk['status'] > 399:
+            return False
+        return digest is None or chunk['sha256'] == digest
+
+    def first_pending(self):
+        """first_pending returns the index of the first chunk not accepted yet"""
+        index = 0
+        while self.accepted(index):
+            index += 1
+        return index
+
+    def record(self, index, filename, digest, status):
+        """record appends the upload status of a chunk to the manifest file"""
+        chunk_rows = self.identity['chunk_rows']
+        self.chunks[index] = {'filename': filename,
+                              'rows': [index * chunk_rows, (index + 1) * chunk_rows],
+                              'sha256': digest,
+                              'status': status}
+        if not self.saved:
+            self.save()
+            return
+        with open(self.filename, 'at', encoding='UTF-8') as manifest_fd:
+            manifest_fd.write(json.dumps(dict(self.chunks[index], index=index)) + '\n')
+
+    def save(self):
+        """save atomically replaces the manifest file with the identity and every chunk"""
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wt', encoding='UTF-8') as manifest_fd:
+            manifest_fd.write(json.dumps({'identity': self.identity}) + '\n')
+            for index in sorted(self.chunks):
+                manifest_fd.write(json.dumps(dict(self.chunks[index], index=index)) + '\n')
+        os.replace(tmp_filename, self.filename)
+        self.saved = True
+
+    def remove(self):
+        """remove deletes the manifest once the load is complete"""
         try:
-            os.makedirs(chunkFolder)
-        except FileExistsError:
+            os.remove(self.filename)
+        except IOError:
             pass
-        fileList.extend(splitFile(filename))
-    else :
-        fileList.append(filename)
 
-    return fileList
 
-def splitFile(filename, chunkSize = 50 * 1000):    
-    fileList = []
-    chunkFile = None
-    header = None
+def load_manifest_filename(dbuuid):
+    """load_manifest_filename returns the manifest file name of a load into dbuuid"""
+    return MANIFEST_FILENAME.format(current_loader().upload_filename.lstrip('.'), dbuuid)
+
+
+def input_identity(some_input, dbuuid, chunk_rows):
+    """input_identity describes a load so that a manifest is only resumed for the same one.
+    Regular files are identified by name, size and modification time. stdin cannot be
+    identified, its loads are never resumed"""
+    identity = {'dbuuid': dbuuid, 'chunk_rows': chunk_rows, 'input': '<stdin>'}
+    if some_input != sys.stdin and 'name' in dir(some_input):
+        statinfo = os.fstat(some_input.fileno())
+        identity.update(input=os.path.realpath(some_input.name), size=statinfo.st_size,
+                        mtime=statinfo.st_mtime)
+    return identity
+
 
-    with open(filename,'rt') as f:
-        csv_reader = csv.reader(f)
+class SaltCache:
+    """SaltCache keeps the salts of GlobalConfig in a JSON file only its owner can read, so
+    that hashing can start without waiting for the Contributor Node. Cached salts are
+    checked against GlobalConfig before anything is uploaded, see SaltCheck"""
+
+    def __init__(self, filename, host, ttl_seconds=SALT_CACHE_TTL_HOURS * 3600):
+        self.filename = os.path.expanduser(filename)
+        self.host = host
+        self.ttl_seconds = ttl_seconds
+
+    def load(self):
+        """load returns the cached salts per field, or None when there are none for host,
+        they expired or the file can be read by other users"""
         try:
-            header = next(csv_reader)
-        except StopIteration:
-            logger.error("Failed to load header from source file {}".format(filename))
-            exit(1)
-        for lineno, line in enumerate(csv_reader):
-            if lineno % chunkSize == 0 :
-                if chunkFile:
-                    chunkFile.close() # reach chunk size, close the current chunk file and start a new one
-                chunkFile_Name = f'chunks/{filename.split("/")[-1]}_chunk_{len(fileList):03d}.csv'
-                fileList.append(chunkFile_Name)
-                chunkFile = open(chunkFile_Name, 'w+')
-                chunkFileWriter = csv.writer(chunkFile)
-                chunkFileWriter.writerow(header)
-            chunkFileWriter.writerow(line)
-        if chunkFile: # close the last chunk file
-            chunkFile.close()
-
-    return fileList
+            with open(self.filename, 'rt', encoding='UTF-8') as cache_fd:
+                if os.name == 'posix' and os.fstat(cache_fd.fileno()).st_mode & 0o077:
+                    logger.warning('Warning: {} can be read by other users and is ignored'.format(
+                        self.filename))
+                    return None
+                saved = json.load(cache_fd)
+        except (IOError, ValueError):
+            return None
+        if not isinstance(saved, dict) or saved.get('version') != SALT_CACHE_VERSION \
+                or saved.get('host') != self.host:
+            return None
+        if not time.time() - self.ttl_seconds < saved.get('retrieved', 0) <= time.time():
+            return None
+        return saved.get('salts')
+
+    def save(self, salts):
+        """save atomically replaces the cache file, created readable by its owner only"""
+        tmp_filename = self.filename + '.tmp'
+        fd = os.open(tmp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'wt', encoding='UTF-8') as cache_fd:
+            os.chmod(tmp_filename, 0o600)
+            json.dump({'version': SALT_CACHE_VERSION, 'host': self.host,
+                       'retrieved': time.time(), 'salts': salts}, cache_fd, indent=2)
+        os.replace(tmp_filename, self.filename)
+
+    def remove(self):
+        """remove deletes the cache file"""
+        try:
+            os.remove(self.filename)
+        except IOError:
+            pass
+
+
+class SaltCheck:
+    """SaltCheck retrieves GlobalConfig on a thread while lines are hashed with cached salts,
+    to compare them before anything is uploaded"""
+
+    def __init__(self, host, auth, ca_verify, salts, cache):
+        self.salts = salts
+        self.cache = cache
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.future = self.pool.submit(in_current_context(fetch_salts), host, auth, ca_verify)
+
+    def result(self):
+        """result waits for GlobalConfig and returns True when the cached salts are the
+        current ones. Otherwise the current salts replace them, in memory and in the cache,
+        and False is returned. None when GlobalConfig could not be retrieved"""
+        salts = self.future.result()
+        self.pool.shutdown()
+        if salts is None:
+            return None
+        if salts == self.salts:
+            return True
+        set_salts(salts)
+        self.cache.save(salts)
+        return False
+
+
+class ChunkUploader:
+    """ChunkUploader uploads the hashed lines to LoadHashedRecords by chunks of
+    chunk_rows input lines, keeping up to parallel_uploads chunks in flight over
+    the shared transport. With a manifest, chunks already accepted are not uploaded again"""
+
+    def __init__(self, host, dbuuid, auth, ca_verify=True, chunk_rows=50000, parallel_uploads=4,
+                 manifest=None):
+        self.host = host
+        self.dbuuid = dbuuid
+        self.auth = auth
+        self.ca_verify = ca_verify
+        self.chunk_rows = chunk_rows
+        self.parallel_uploads = parallel_uploads
+        self.manifest = manifest
+        self.session = shared_transport()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=parallel_uploads)
+        self.pending = collections.deque()
+        self.statuses = []
+        self.header = ''
+        self.chunk_count = 0
+        self.aborted = False
+
+    def writeheader(self, fieldnames):
+        """writeheader sets the header line written at the top of every chunk"""
+        buf = io.StringIO()
+        csv.writer(buf).writerow(fieldnames)
+        self.header = buf.getvalue()
+
+    def chunk_filename(self, index):
+        """chunk_filename names the chunk index after the uploaded file"""
+        return '{}_chunk_{:03d}.csv'.format(current_loader().upload_filename, index)
+
+    def resume(self):
+        """resume skips the chunks accepted in a previous run, up to the first
+        rejected one, and returns the number of input lines they hold"""
+        if self.manifest is None:
+            return 0
+        self.chunk_count = self.manifest.first_pending()
+        if self.chunk_count:
+            print('Resuming load from chunk {}'.format(self.chunk_count), file=sys.stderr)
+        return self.chunk_count * self.chunk_rows
+
+    def collect(self):
+        """collect waits for the oldest upload in flight and records its status"""
+        index, filename, digest, future = self.pending.popleft()
+        status = future.result()
+        self.statuses.append(status)
+        if self.manifest is not None:
+            self.manifest.record(index, filename, digest, status)
+
+    def write(self, hashed_batch):
+        """write uploads hashed_batch as the next chunk. It waits for the oldest
+        upload when parallel_uploads other chunks are in flight, and returns False once
+        a chunk has been rejected"""
+        index = self.chunk_count
+        self.chunk_count += 1
+        if isinstance(hashed_batch, bytes):
+            payload = self.header.encode('utf-8') + hashed_batch
+        else:
+            payload = (self.header + hashed_batch).encode('utf-8')
+        digest = hashlib.sha256(payload).hexdigest()
+        if self.manifest is not None and self.manifest.accepted(index, digest):
+            return True
+
+        filename = self.chunk_filename(index)
+        future = self.pool.submit(in_current_context(post_hashed_records), self.session,
+                                  self.host, self.dbuuid, self.auth, self.ca_verify, filename,
+                                  payload)
+        self.pending.append((index, filename, digest, future))
+        while len(self.pending) > self.parallel_uploads:
+            self.collect()
+        while self.pending and self.pending[0][3].done():
+            self.collect()
+        return not self.statuses or max(self.statuses) < 400
+
+    def abort(self):
+        """abort stops the load after a hashing error. Chunks already uploaded stay loaded"""
+        self.aborted = True
+
+    def close(self):
+        """close waits for the chunks in flight and returns the worst status code.
+        The manifest is removed once every chunk has been accepted"""
+        if not self.chunk_count and not self.aborted:
+            # Let the Contributor Node judge a file without any line
+            self.write('')
+        while self.pending:
+            self.collect()
+        self.pool.shutdown()
+        status = max(self.statuses, default=200)
+        if self.manifest is not None:
+            if status < 400:
+                self.manifest.remove()
+            else:
+                logger.error('Error: load interrupted, run again with --resume to continue '
+                             'from chunk {}'.format(self.manifest.first_pending()))
+        return status
+
+
+class DeltaIndex:
+    """DeltaIndex keeps in an SQLite file the personid and digest of every hashed line
+    of the last successful load. It drops the lines unchanged since then and adds delete
+    lines for the personids that disappeared. The lines of the current load are only
+    made the reference by commit, once the Contributor Node accepted them"""
+
+    def __init__(self, filename, dbuuid):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(
+            'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);'
+            'CREATE TABLE IF NOT EXISTS rows (personid TEXT PRIMARY KEY, digest BLOB);'
+            'CREATE TEMP TABLE seen (personid TEXT PRIMARY KEY, digest BLOB, changed INTEGER);')
+        saved = self.connection.execute("SELECT value FROM meta WHERE key = 'dbuuid'").fetchone()
+        if saved is not None and saved[0] != dbuuid:
+            logger.warning('Warning: {} was made for another DBUUID and is ignored'.format(filename))
+            self.connection.execute('DELETE FROM rows')
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('dbuuid', ?)", (dbuuid,))
+        self.connection.commit()
+        self.fieldnames = []
+        self.append_operation = False
+        self.seed = None
+
+    def start(self, fieldnames):
+        """start returns the header of the lines to load, with an operation column
+        added when the input has none"""
+        self.append_operation = 'operation' not in fieldnames
+        self.fieldnames = fieldnames + ['operation'] if self.append_operation else list(fieldnames)
+        self.personid_pos = self.fieldnames.index('personid')
+        self.operation_pos = self.fieldnames.index('operation')
+        # A change of columns changes every digest
+        self.seed = hashlib.blake2b('\x1f'.join(self.fieldnames).encode('utf-8'), digest_size=16)
+        return self.fieldnames
+
+    def previous_digests(self, personids):
+        """previous_digests returns the digests of the last load for personids"""
+        digests = {}
+        for start in range(0, len(personids), DELTA_LOOKUP_ROWS):
+            chunk = personids[start:start + DELTA_LOOKUP_ROWS]
+            digests.update(self.connection.execute(
+                'SELECT personid, digest FROM rows WHERE personid IN ({})'.format(
+                    ','.join('?' * len(chunk))), chunk))
+        return digests
+
+    def filter(self, hashed_batch):
+        """filter returns the CSV text of the lines of hashed_batch new or changed
+        since the last load. Lines without personid and delete lines are always kept"""
+        rows = list(csv.reader(io.StringIO(hashed_batch)))
+        previous = self.previous_digests([row[self.personid_pos] for row in rows])
+        kept = []
+        seen = []
+        for row in rows:
+            if self.append_operation:
+                row.append('')
+            personid = row[self.personid_pos]
+            if not personid:
+                kept.append(row)
+                continue
+            if row[self.operation_pos] == DELTA_DELETE_OPERATION:
+                # Seen, but not part of the next reference
+                seen.append((personid, None, True))
+                kept.append(row)
+                continue
+            line_digest = self.seed.copy()
+            line_digest.update('\x1f'.join(row).encode('utf-8'))
+            digest = line_digest.digest()
+            changed = previous.get(personid) != digest
+            seen.append((personid, digest, changed))
+            if changed:
+                kept.append(row)
+        self.connection.executemany('INSERT OR REPLACE INTO seen VALUES (?, ?, ?)', seen)
+        if STATS is not None:
+            STATS.add('rows_unchanged', len(rows) - len(kept))
+        buf = io.StringIO()
+        csv.writer(buf).writerows(kept)
+        return buf.getvalue()
+
+    def deletions(self, batch_rows=None):
+        """deletions yields the CSV text of the delete lines of the personids loaded
+        last time but missing from this load, by batches of batch_rows lines"""
+        cursor = self.connection.execute(
+            'SELECT personid FROM rows WHERE personid NOT IN (SELECT personid FROM seen)')
+        while True:
+            personids = cursor.fetchmany(batch_rows or BATCH_ROWS)
+            if not personids:
+                return
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            for personid, in personids:
+                row = [''] * len(self.fieldnames)
+                row[self.personid_pos] = personid
+                row[self.operation_pos] = DELTA_DELETE_OPERATION
+                writer.writerow(row)
+            if STATS is not None:
+                STATS.add('rows_deleted', len(personids))
+            yield buf.getvalue()
+
+    def filter_batches(self, hashed_batches):
+        """filter_batches runs filter over hashed_batches, then yields the deletions"""
+        for hashed_batch in hashed_batches:
+            kept = self.filter(hashed_batch)
+            if kept:
+                yield kept
+        yield from self.deletions()
+
+    def commit(self):
+        """commit makes the lines of this load the reference of the next one"""
+        with self.connection:
+            self.connection.execute('DELETE FROM rows WHERE personid NOT IN '
+                                    '(SELECT personid FROM seen WHERE digest IS NOT NULL)')
+            self.connection.execute('INSERT OR REPLACE INTO rows SELECT personid, digest FROM seen '
+                                    'WHERE changed AND digest IS NOT NULL')
+            self.connection.execute('DELETE FROM seen')
+
+    def close(self):
+        """close leaves the index as committed last"""
+        self.connection.rollback()
+        self.connection.close()
+
+
+def delta_index_filename(dbuuid):
+    """delta_index_filename returns the default delta index file name of dbuuid"""
+    return DELTA_INDEX_FILENAME.format(dbuuid)
+
+
+class StreamUploader:
+    """StreamUploader uploads the hashed lines to LoadHashedRecords while they are hashed,
+    in a single request whose multipart body is sent with chunked transfer encoding.
+    Nothing is written to disk. It has the ChunkUploader interface, without resume"""
+
+    def __init__(self, host, dbuuid, auth, ca_verify=True):
+        self.host = host
+        self.dbuuid = dbuuid
+        self.auth = auth
+        self.ca_verify = ca_verify
+        # One batch of BATCH_ROWS lines at a time
+        self.chunk_rows = None
+        self.pending = queue.Queue(PIPELINE_QUEUE_BATCHES)
+        self.status = None
+        self.thread = None
+
+    def start(self):
+        """start sends the request, its body being fed by write"""
+        if self.thread is None:
+            # Daemon, so that an exit() while hashing is not held up by the request
+            self.thread = threading.Thread(target=in_current_context(self.post), daemon=True)
+            self.thread.start()
+
+    def post(self):
+        try:
+            self.status = post_hashed_records(shared_transport(), self.host, self.dbuuid,
+                                              self.auth, self.ca_verify,
+                                              current_loader().upload_filename, self.body())
+        except UploadAbortedError:
+            self.status = 500
+
+    def body(self):
+        """body yields the bytes written until close or abort"""
+        while True:
+            data = self.pending.get()
+            if data is PIPELINE_END:
+                return
+            if data is None:
+                # The connection is closed without terminating the body
+                raise UploadAbortedError
+            data = data.encode('utf-8')
+            if STATS is not None:
+                STATS.add('upload_bytes', len(data))
+            yield data
+
+    def put(self, data):
+        """put queues data for the request body, and returns False once the request ended"""
+        self.start()
+        while self.thread.is_alive():
+            try:
+                self.pending.put(data, timeout=PIPELINE_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def writeheader(self, fieldnames):
+        """writeheader writes the header line at the top of the body"""
+        buf = io.StringIO()
+        csv.writer(buf).writerow(fieldnames)
+        self.put(buf.getvalue())
+
+    def resume(self):
+        """resume has nothing to skip, a streamed load is a single request"""
+        return 0
+
+    def write(self, hashed_batch):
+        """write appends hashed_batch to the body. It returns False once the request
+        ended early, e.g. the Contributor Node closed the connection"""
+        return self.put(hashed_batch)
+
+    def abort(self):
+        """abort cuts the request short, so that nothing gets loaded"""
+        self.put(None)
+
+    def close(self):
+        """close ends the body and returns the status code of the request"""
+        self.put(PIPELINE_END)
+        self.thread.join()
+        return self.status
+
+
+class Loader:
+    """Loader owns the state of the loads into a Contributor Node: the mapping and its salts,
+    the parsed headers and ROW_PLAN, the buffer file, the upload compression, the hash cache
+    and the HTTP session. Loaders do not share any of it, so that loads into different DBUUIDs
+    can run concurrently on threads of one process, with a Loader per load in flight. The
+    loads of a Loader run one after the other. --stats is per process"""
+
+    def __init__(self, mapping=None, upload_compression=None, buffer_compression=False,
+                 transport=None):
+        if mapping is None:
+            # Salts of the default mapping may be the ones of another Contributor Node
+            mapping = {field: {key: value for key, value in definition.items()
+                               if key != 'salt' or value is False}
+                       for field, definition in DATABANK_SENATE_MATCHING_MAPPING.items()}
+        self.mapping = copy.deepcopy(mapping)
+        self.databank_headers = {}
+        self.match = {}
+        self.row_plan = []
+        self.hashed_input = False
+        self.buf_filename = '.dataloader_script_{}_{}.csv'.format(os.getpid(), next(LOADER_IDS))
+        self.upload_filename = self.buf_filename
+        self.upload_compression = upload_compression
+        self.buffer_compression = buffer_compression
+        self.transport = transport
+        self.hash_cache = None
+        self.hash_cache_megabytes = 0
+        self.hash_cache_worker_counters = {'hits': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def activate(self):
+        """activate makes the loader the current loader of the with block, and of the
+        threads started in it"""
+        token = CURRENT_LOADER.set(self)
+        try:
+            yield self
+        finally:
+            CURRENT_LOADER.reset(token)
+
+    def retrieve_salts(self, host, auth, ca_verify=True):
+        """retrieve_salts retrieves the salts of the loader from GlobalConfig"""
+        with self.activate():
+            return retrieve_salts(host, auth, ca_verify)
+
+    def field_salts(self):
+        """field_salts returns the salts of the loader, per field"""
+        with self.activate():
+            return field_salts()
+
+    def set_salts(self, salts):
+        """set_salts sets the salt of every field of salts, e.g. the ones of
+        field_salts of another loader of the same Contributor Node"""
+        with self.activate():
+            set_salts(salts)
+
+    def load(self, args, host, auth, ca_verify=True, salts_retrieved=False):
+        """load runs load_file for the loader, and returns the exit code and number of
+        tokens written. exit() on an invalid input gives its exit code"""
+        with self.lock, self.activate():
+            recover_temp_buffer_name()
+            try:
+                return load_file(args, host, auth, ca_verify, salts_retrieved)
+            except SystemExit as ex:
+                return (ex.code if isinstance(ex.code, int) else 1), 0
+            finally:
+                clean_buf_env()
+
+    def close(self):
+        """close closes the HTTP session of the loader"""
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+def module_global(name):
+    """module_global returns a property reading and setting the module global name"""
+    return property(lambda self: globals()[name],
+                    lambda self, value: globals().__setitem__(name, value))
+
+
+class ModuleLoader(Loader):
+    """ModuleLoader is the Loader of the module functions and of the command line,
+    its state being the module globals"""
+    mapping = module_global('DATABANK_SENATE_MATCHING_MAPPING')
+    databank_headers = module_global('DATABANK_HEADERS')
+    match = module_global('MATCH')
+    row_plan = module_global('ROW_PLAN')
+    hashed_input = module_global('HASHED_INPUT')
+    buf_filename = module_global('HITCH_BUF_FILENAME')
+    upload_filename = module_global('UPLOAD_FILENAME')
+    upload_compression = module_global('UPLOAD_COMPRESSION')
+    buffer_compression = module_global('BUFFER_COMPRESSION')
+    transport = module_global('TRANSPORT')
+    hash_cache = module_global('cached_salted_hash')
+    hash_cache_megabytes = module_global('HASH_CACHE_MEGABYTES')
+    hash_cache_worker_counters = module_global('HASH_CACHE_WORKER_COUNTERS')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+DEFAULT_LOADER = ModuleLoader()
+
+
+def load_file(args, host, auth, ca_verify, salts_retrieved=False):
+    """load_file loads args.input into args.uuid and writes the mapping file to args.output,
+    following the command line options in args. Returns the exit code and the number of
+    tokens written. It runs for the current loader, see Loader.load"""
+    loader = current_loader()
+    if args.parallel_uploads < 1:
+        logger.error('Error: parallel_uploads must be 1 or more')
+        return 1, 0
+    override_temp_buffer_name(args.input)
+    # Pre-hashed lines go through the same pipeline, their digests being checked
+    loader.hashed_input = bool(args.hashed)
+    delta = None
+    salt_check = None
+    if not loader.hashed_input and not salts_retrieved:
+        salt_cache = None
+        cached_salts = None
+        if args.salt_cache is not None:
+            salt_cache = SaltCache(args.salt_cache or SALT_CACHE_FILENAME, host,
+                                   args.salt_cache_ttl * 3600)
+            cached_salts = salt_cache.load()
+        if cached_salts is not None:
+            # Hashing starts right away, GlobalConfig is checked before anything is uploaded
+            set_salts(cached_salts)
+            salt_check = SaltCheck(host, auth, ca_verify, cached_salts, salt_cache)
+        else:
+            salts = fetch_salts(host, auth, ca_verify)
+            if salts is None:
+                return 2, 0
+            set_salts(salts)
+            if salt_cache is not None:
+                salt_cache.save(salts)
+    if not loader.hashed_input:
+        configure_hash_cache(args.hash_cache)
+    uploader = None
+    chunk_rows = args.chunk_rows
+    if args.resume and chunk_rows <= 0:
+        chunk_rows = RESUME_CHUNK_ROWS
+    if args.resume and input_identity(args.input, args.uuid, chunk_rows)['input'] == '<stdin>':
+        logger.error('Error: --resume needs an input file, lines read from stdin cannot be '
+                     'checked against the manifest')
+        return 1, 0
+    if salt_check is not None and (chunk_rows > 0 or args.stream):
+        # Lines are uploaded while they are hashed: the salts are checked before
+        if salt_check.result() is None:
+            return 2, 0
+        salt_check = None
+    uploader_closed = False
+    reader = None
+    try:
+        if chunk_rows > 0:
+            identity = input_identity(args.input, args.uuid, chunk_rows)
+            manifest = LoadManifest(load_manifest_filename(args.uuid), identity)
+            if args.resume:
+                manifest = LoadManifest.load(manifest.filename, identity)
+            uploader = ChunkUploader(host, args.uuid, auth, ca_verify,
+                                     chunk_rows, args.parallel_uploads, manifest)
+        elif args.stream:
+            uploader = StreamUploader(host, args.uuid, auth, ca_verify)
+        if args.delta is not None:
+            delta = DeltaIndex(args.delta or delta_index_filename(args.uuid), args.uuid)
+        if args.input_format != 'csv':
+            reader = ArrowReader(args.input.name, args.input_format)
+        elif args.mmap and args.input != sys.stdin:
+            reader = MappedCSV(args.input.name, args.delimiter, exit_on_failure=True)
+        else:
+            reader = read_csv(args.input, args.delimiter, exit_on_failure=True)
+        generated = generate_hitch_csv(reader, args.workers, uploader, delta)
+        if uploader is not None:
+            uploader_closed = True
+            status = uploader.close()
+    except BaseException:
+        # e.g. exit() on an invalid line: no request or upload thread is left behind,
+        # which matters to the long-lived processes running a Loader
+        if uploader is not None and not uploader_closed:
+            uploader.abort()
+            uploader.close()
+        if delta is not None:
+            delta.close()
+        raise
+    finally:
+        if isinstance(reader, MappedCSV):
+            reader.close()
+    try:
+        if not generated:
+            return 1, 0
+        if salt_check is not None:
+            salts_current = salt_check.result()
+            if not salts_current:
+                # Lines hashed with outdated salts must never be uploaded
+                clean_buf_env()
+                if delta is not None:
+                    delta.close()
+                    delta = None
+                if salts_current is None:
+                    return 2, 0
+                if args.input == sys.stdin or not args.input.seekable():
+                    logger.error('Error: salts changed since they were cached, run again')
+                    return 2, 0
+                logger.warning('Warning: salts changed since they were cached, hashing again')
+                args.input.seek(0)
+                return load_file(args, host, auth, ca_verify, salts_retrieved=True)
+        if not loader.hashed_input:
+            report_hash_cache()
+        if args.hashed_output:
+            write_hashed_parquet(args.hashed_output)
+        if uploader is None:
+            status = load_hashed_records(host, args.uuid, auth, ca_verify,
+                                         parallel_uploads=args.parallel_uploads)
+
+        if status > 399:
+            return (1 if status < 500 else 2), 0
+        if delta is not None:
+            delta.commit()
+        output = args.output.name if args.output_format == 'parquet' else args.output
+        token_count, status = stream_loaded_tokens(host, args.uuid, auth, output, ca_verify,
+                                                   args.output_format)
+        if not (status and token_count):
+            return 2, token_count
+        return 0, token_count
+    finally:
+        if delta is not None:
+            delta.close()
+
+
+def read_batch_manifest(filename):
+    """read_batch_manifest returns the jobs of a batch manifest, a JSON list of
+    {"input", "uuid", "delimiter", "hashed", "output"} objects. Only input and uuid are
+    mandatory, hashed is a boolean or a strtobool string. An input directory gives a job
+    per *.csv file in it, output then being the directory of their mapping files. Mapping
+    files are <input>.mapping.csv by default. Relative paths are relative to the manifest"""
+    with open(filename, 'rt', encoding='UTF-8') as manifest_fd:
+        entries = json.load(manifest_fd)
+    base = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    for entry in entries:
+        input_path = os.path.join(base, entry['input'])
+        hashed = entry.get('hashed', False)
+        if isinstance(hashed, str):
+            hashed = bool(strtobool(hashed))
+        elif not isinstance(hashed, bool):
+            raise ValueError('invalid hashed value {!r}'.format(hashed))
+        output = entry.get('output')
+        if os.path.isdir(input_path):
+            inputs = sorted(os.path.join(input_path, name) for name in os.listdir(input_path)
+                            if name.endswith('.csv') and not name.endswith('.mapping.csv'))
+            outputs = [os.path.join(base, output, os.path.basename(name) + '.mapping.csv')
+                       if output else name + '.mapping.csv' for name in inputs]
+        else:
+            inputs = [input_path]
+            outputs = [os.path.join(base, output) if output else input_path + '.mapping.csv']
+        for input_filename, output_filename in zip(inputs, outputs):
+            jobs.append({'input': input_filename,
+                         'uuid': str(entry['uuid']),
+                         'delimiter': entry.get('delimiter', ','),
+                         'hashed': hashed,
+                         'output': output_filename})
+    return jobs
+
+
+def init_batch_worker(options, salts, upload_compression, buffer_compression):
+    """init_batch_worker sets up a batch process: salts retrieved once for every job,
+    compression, its own buffer file and a transport reused by all its jobs"""
+    global HITCH_BUF_FILENAME, UPLOAD_COMPRESSION, BUFFER_COMPRESSION
+    setup_logging()
+    CURRENT_LOADER.set(DEFAULT_LOADER)
+    set_salts(salts)
+    UPLOAD_COMPRESSION = upload_compression
+    BUFFER_COMPRESSION = buffer_compression
+    HITCH_BUF_FILENAME = '.dataloader_script_{}.csv'.format(os.getpid())
+    configure_transport(options['parallel_uploads'], options['timeout'], options['retries'])
+    if isinstance(options['ca_verify'], bool) and not options['ca_verify']:
+        requests.packages.urllib3.disable_warnings(
+            requests.packages.urllib3.exceptions.InsecureRequestWarning)
+
+
+def run_batch_job(job, options, host, api_key):
+    """run_batch_job runs load_file for a job of read_batch_manifest in a batch process,
+    and returns the job with its exit code, number of tokens and duration"""
+    started = time.monotonic()
+    recover_temp_buffer_name()
+    exit_code, token_count = 1, 0
+    try:
+        with open(job['input'], 'rt', encoding='UTF-8') as input_fd, \
+                open(job['output'], 'wt', encoding='UTF-8') as output_fd:
+            args = argparse.Namespace(input=input_fd, output=output_fd, uuid=job['uuid'],
+                                      delimiter=job['delimiter'], hashed=job['hashed'],
+                                      **options)
+            exit_code, token_count = load_file(args, host,
+                                               requests.auth.HTTPBasicAuth('api', api_key),
+                                               options['ca_verify'], salts_retrieved=True)
+    except IOError as ex:
+        logger.error('Error: {}'.format(ex))
+    except SystemExit as ex:
+        # exit() on an invalid input
+        exit_code = ex.code if isinstance(ex.code, int) else 1
+    finally:
+        clean_buf_env()
+    return dict(job, exit_code=exit_code, tokens=token_count,
+                seconds=round(time.monotonic() - started, 3))
+
+
+def run_batch(jobs, options, host, api_key, parallel_jobs=4):
+    """run_batch runs the jobs of read_batch_manifest on parallel_jobs processes, retrieving
+    the salts only once. Returns the results of run_batch_job in jobs order, or None when
+    the salts could not be retrieved"""
+    if not all(job['hashed'] for job in jobs) and \
+            not retrieve_salts(host, requests.auth.HTTPBasicAuth('api', api_key),
+                               options['ca_verify']):
+        return None
+    loader = current_loader()
+    results = [None] * len(jobs)
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=parallel_jobs, initializer=init_batch_worker,
+            initargs=(options, field_salts(), loader.upload_compression,
+                      loader.buffer_compression)) as pool:
+        pending = {pool.submit(run_batch_job, job, options, host, api_key): index
+                   for index, job in enumerate(jobs)}
+        for future in concurrent.futures.as_completed(pending):
+            result = future.result()
+            print('{} -> {}: exit code {}, {} tokens in {:.1f}s'.format(
+                result['input'], result['uuid'], result['exit_code'], result['tokens'],
+                result['seconds']), file=sys.stderr)
+            results[pending[future]] = result
+    return results
+
+
+def write_batch_summary(summary, results):
+    """write_batch_summary writes the results of run_batch as CSV"""
+    fieldnames = ['input', 'uuid', 'output', 'exit_code', 'tokens', 'seconds']
+    writer = csv.DictWriter(summary, fieldnames, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(results)
+
 
 if __name__ == '__main__':
+    setup_logging()
     parser = argparse.ArgumentParser(description="A tool to load data from a CSV file into a Senate Matching Contributor Node")
-    parser.add_argument('-u', '--uuid', help='UUID to write data into', required=True)
+    parser.add_argument('-u', '--uuid', help='UUID to write data into. Required unless --batch '
+                                             'is given', required=False)
     parser.add_argument('-i', '--input', help='Read from filename. The file must be readable '
                                               'and in CSV format encoded in UTF-8',
                         type=argparse.FileType('rt', encoding='UTF-8'),
@@ -605,39 +2851,194 @@ if __name__ == '__main__':
                         help='CSV Delimiter on the input file. Comma by default. To use tab, enter: $\'\\t\'',
                         default=',',
                         required=False)
+    parser.add_argument('--input-format',
+                        choices=['csv', 'parquet', 'arrow'],
+                        help='Format of the input file: csv, the default, parquet or arrow (Arrow '
+                             'IPC file). parquet and arrow need the pyarrow package',
+                        default='csv',
+                        required=False)
+    parser.add_argument('--output-format',
+                        choices=['csv', 'parquet'],
+                        help='Format of the mapping file: csv, the default, or parquet. parquet '
+                             'needs the pyarrow package',
+                        default='csv',
+                        required=False)
+    parser.add_argument('--hashed-output',
+                        metavar='FILE',
+                        help='Also write the hashed lines uploaded to FILE, as Parquet. Needs '
+                             'the pyarrow package',
+                        required=False)
+    parser.add_argument('--mmap',
+                        action='store_true',
+                        help='Memory map the input file and hand out lines to the hashing '
+                             'processes by byte ranges. Ignored when reading from stdin',
+                        required=False)
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of processes used to hash the file. 1 by default',
+                        default=1,
+                        required=False)
+    parser.add_argument('--hash-cache',
+                        type=float,
+                        help='Memory ceiling in MB of the cache of hashed values, per hashing '
+                             'process. 0 disables the cache. 64 by default',
+                        default=64,
+                        required=False)
+    parser.add_argument('--chunk-rows',
+                        type=int,
+                        help='Upload the hashed lines by chunks of this many input lines '
+                             'while hashing goes on. 0 uploads a single file once hashed, the default',
+                        default=0,
+                        required=False)
+    parser.add_argument('--parallel-uploads',
+                        type=positive_int,
+                        help='Number of chunk uploads in flight with --chunk-rows. 4 by default',
+                        default=4,
+                        required=False)
+    parser.add_argument('--compress',
+                        choices=['gzip', 'zstd'],
+                        help='Compress the uploads to LoadHashedRecords. Uploads are plain again '
+                             'if the Contributor Node rejects them. zstd needs the zstandard package',
+                        required=False)
+    parser.add_argument('--compress-buffer',
+                        action='store_true',
+                        help='Keep the hashed lines buffer file gzip compressed on disk',
+                        required=False)
+    parser.add_argument('--timeout',
+                        type=float,
+                        help='Seconds to wait for every read from the Contributor Node. '
+                             '{} by default'.format(HTTP_READ_TIMEOUT),
+                        default=HTTP_READ_TIMEOUT,
+                        required=False)
+    parser.add_argument('--retries',
+                        type=int,
+                        help='Number of retries, with exponential backoff, of a request that '
+                             'failed to connect, timed out or got a 429, 502, 503 or 504. '
+                             'Uploads that timed out are not retried. '
+                             '{} by default'.format(HTTP_RETRIES),
+                        default=HTTP_RETRIES,
+                        required=False)
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Upload the hashed lines while hashing goes on, in a single request '
+                             'with a chunked transfer encoded body, without any buffer file',
+                        required=False)
+    parser.add_argument('--resume',
+                        action='store_true',
+                        help='Resume a chunked load that previously failed, skipping the chunks '
+                             'already accepted by the Contributor Node',
+                        required=False)
+    parser.add_argument('--delta',
+                        nargs='?',
+                        const='',
+                        metavar='INDEX',
+                        help='Only upload the lines new or changed since the last successful load, '
+                             'plus delete lines for the personids gone since then. The last load '
+                             'is recorded in the INDEX SQLite file, '
+                             + DELTA_INDEX_FILENAME.format('<uuid>') + ' by default',
+                        required=False)
+    parser.add_argument('--batch',
+                        metavar='MANIFEST',
+                        help='Run the loads listed in the MANIFEST JSON file instead of a single '
+                             'one: a list of {"input", "uuid", "delimiter", "hashed", "output"} '
+                             'objects. A CSV summary of the loads is written to --output',
+                        required=False)
+    parser.add_argument('--parallel-jobs',
+                        type=positive_int,
+                        help='Number of loads run at once with --batch. 4 by default',
+                        default=4,
+                        required=False)
+    parser.add_argument('--stats',
+                        action='store_true',
+                        help='Print progress lines and a JSON summary of the time spent in every '
+                             'stage and of the rows, bytes and requests processed on stderr',
+                        required=False)
+    parser.add_argument('--stats-interval',
+                        type=float,
+                        help='Seconds between two progress lines with --stats. 30 by default',
+                        default=STATS_PROGRESS_SECONDS,
+                        required=False)
+    parser.add_argument('--salt-cache',
+                        nargs='?',
+                        const='',
+                        metavar='FILE',
+                        help='Cache the salts of the Contributor Node in FILE, '
+                             '~/.dataloader_salts.json by default, so that hashing starts '
+                             'right away. Cached salts are checked before anything is uploaded',
+                        default=None,
+                        required=False)
+    parser.add_argument('--salt-cache-ttl',
+                        type=float,
+                        help='Hours cached salts are used for. 24 by default',
+                        default=SALT_CACHE_TTL_HOURS,
+                        required=False)
     parser.add_argument('--hashed',
                         type=strtobool,
                         help='Specify True if the file has hashed to skip second hashing',
                         default=False,
                         required=False)
     args = parser.parse_args()
+    if args.batch is None and args.uuid is None:
+        parser.error('the following arguments are required: -u/--uuid')
+    if args.batch is not None and (args.delta is not None or args.resume or args.stats):
+        parser.error('--batch cannot be combined with --delta, --resume or --stats')
+    if args.batch is not None and args.workers > 1:
+        # Batch processes are daemonic before Python 3.9, they cannot start hashing processes
+        parser.error('--batch runs every load in its own process, it cannot be combined with '
+                     '--workers above 1')
+    if args.stream and (args.chunk_rows > 0 or args.resume):
+        parser.error('--stream is a single request, it cannot be combined with '
+                     '--chunk-rows or --resume')
+    if (args.input_format != 'csv' or args.output_format != 'csv' or args.hashed_output) \
+            and load_pyarrow() is None:
+        parser.error('--input-format, --output-format and --hashed-output need the pyarrow '
+                     'package: pip install pyarrow')
+    if args.input_format != 'csv' and args.input == sys.stdin:
+        parser.error('--input-format {} needs an -i file'.format(args.input_format))
+    if args.output_format == 'parquet' and args.output == sys.stdout and args.batch is None:
+        parser.error('--output-format parquet needs an -o file')
+    if args.hashed_output and (args.chunk_rows > 0 or args.resume or args.stream
+                               or args.batch is not None):
+        parser.error('--hashed-output cannot be combined with --chunk-rows, --resume, '
+                     '--stream or --batch')
+    if args.compress == 'zstd' and load_zstandard() is None:
+        parser.error('--compress zstd needs the zstandard package: pip install zstandard')
+    if args.delta is not None and args.resume:
+        parser.error('--delta cannot resume a load, run it again without --resume')
+    if args.resume and args.input == sys.stdin:
+        parser.error('--resume needs an -i file, lines read from stdin cannot be checked '
+                     'against the manifest')
 
     validate_env()
+    if args.stats:
+        enable_stats(args.stats_interval)
 
     host = hitch_contributor_node_url()
-    auth = HTTPBasicAuth('api', os.environ['HITCH_API_KEY'])
+    configure_transport(args.parallel_uploads, args.timeout, args.retries)
+    UPLOAD_COMPRESSION = args.compress
+    BUFFER_COMPRESSION = args.compress_buffer
+    auth = requests.auth.HTTPBasicAuth('api', os.environ['HITCH_API_KEY'])
     req_ca_verify = requests_ca_verify()
     if isinstance(req_ca_verify, bool) and not req_ca_verify:
-        requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        requests.packages.urllib3.disable_warnings(
+            requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
-    override_temp_buffer_name(args.input)
-    if args.hashed:
-        status = load_hashed_records(host, args.uuid, auth, req_ca_verify, args.input.fileno())
-    else:
-        if not retrieve_salts(host, auth, req_ca_verify):
-            exit(2)
-        if not generate_hitch_csv(read_csv(args.input, args.delimiter, exit_on_failure=True)):
-            exit(1)
-        status = load_hashed_records(host, args.uuid, auth, req_ca_verify)
-    
-    if status > 399:
-        if status < 500:
+    if args.batch is not None:
+        try:
+            jobs = read_batch_manifest(args.batch)
+        except (IOError, ValueError, KeyError, TypeError) as ex:
+            logger.error('Error: invalid batch manifest {}: {}'.format(args.batch, ex))
             exit(1)
-        else:
+        options = {name: value for name, value in vars(args).items()
+                   if name not in ['input', 'output', 'uuid', 'delimiter', 'hashed', 'batch',
+                                   'parallel_jobs']}
+        options['ca_verify'] = req_ca_verify
+        results = run_batch(jobs, options, host, os.environ['HITCH_API_KEY'], args.parallel_jobs)
+        if results is None:
             exit(2)
+        write_batch_summary(args.output, results)
+        exit(max([result['exit_code'] for result in results], default=0))
 
-        exit(2)
-    token_tuples, status = contributor_loaded_tokens(host, args.uuid, auth, req_ca_verify)
-    if not (status and token_tuples):
-        exit(2)
-    write_output(args.output, token_tuples)
\ No newline at end of file
+    exit_code, _ = load_file(args, host, auth, req_ca_verify)
+    if exit_code:
+        exit(exit_code)
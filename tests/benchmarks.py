@@ -0,0 +1,340 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""benchmarks for dataloader.py
+
+Runs offline on a synthetic Databank extract with stubbed salts and reports
+the throughput of every stage of the normalize, hash and write pipeline.
+Results can be saved as JSON to compare releases:
+
+    $ python ./tests/benchmarks.py --rows 200000 --workers 4 --json bench.json
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import dataloader
+
+PHONE_VALUES = ['+61468732838', '(02) 9876 5432', '+61 4 1800-FLOWERS', '０４６８７３２８３８', '']
+
+# Databank columns of the synthetic extract per Senate Matching field, by multi value position
+DATABANK_COLUMNS = {
+    'personid': ['natural_key'],
+    'family_name': ['family_names'],
+    'given_name': ['first_name'],
+    'email': ['contact_email_address', 'alternate_email_address'],
+    'phone': ['contact_mobile_number', 'alternate_mobile_number',
+              'contact_landline_number', 'alternate_landline_number'],
+    'dpid': ['contact_aus_dpid', 'alternate_aus_dpid'],
+    'birthdate': ['birthdate'],
+    'postcode': ['postcode'],
+    'operation': ['operation'],
+}
+DEFAULT_FIELDS = ['personid', 'family_name', 'given_name', 'email', 'phone', 'dpid',
+                  'birthdate', 'postcode']
+
+FAMILY_NAMES = ["Smith", "O'Brien", "McMahon", "Nguyen", "van der Berg", "Lee-Wong", "Papadopoulos"]
+GIVEN_NAMES = ['Jack', 'Olivia', 'Noah', 'Charlotte', 'William', 'Mia', 'Jean-Luc']
+CJK_FAMILY_NAMES = ['山田', '佐藤', 'ｽｽﾞｷ', 'タナカ', '김', '王']
+CJK_GIVEN_NAMES = ['太郎', 'ハナコ', 'ﾕｳｷ', '민준', '伟']
+DOMAINS = ['example.com', 'mail.com.au', 'EXAMPLE.ORG']
+# Translate table of printable ASCII to the Fullwidth Forms
+TO_FULLWIDTH = {code_point: code_point + 0xFEE0 for code_point in range(0x21, 0x7F)}
+
+
+def stub_salts():
+    """stub_salts sets a fixed salt on every field retrieve_salts would salt"""
+    for field in dataloader.DATABANK_SENATE_MATCHING_MAPPING:
+        if dataloader.DATABANK_SENATE_MATCHING_MAPPING[field].get('salt', True):
+            dataloader.DATABANK_SENATE_MATCHING_MAPPING[field]['salt'] = 'benchmark-salt-' + field
+
+
+def synthetic_value(field, rnd, cjk):
+    """synthetic_value returns a raw Databank value for field"""
+    if field == 'family_name':
+        return rnd.choice(CJK_FAMILY_NAMES if cjk else FAMILY_NAMES)
+    if field == 'given_name':
+        return rnd.choice(CJK_GIVEN_NAMES if cjk else GIVEN_NAMES)
+    if field == 'email':
+        local = '{}.{}'.format(rnd.choice(GIVEN_NAMES), rnd.randint(1, 99999))
+        email = '{}@{}'.format(local, rnd.choice(DOMAINS))
+        return email.translate(TO_FULLWIDTH) if cjk else email
+    if field == 'phone':
+        number = '+61 4{:02d} {:03d} {:03d}'.format(rnd.randint(0, 99), rnd.randint(0, 999),
+                                                   rnd.randint(0, 999))
+        return number.translate(TO_FULLWIDTH) if cjk else number
+    if field == 'dpid':
+        return str(rnd.randint(30000000, 99999999))
+    if field == 'birthdate':
+        return '{:04d}-{:02d}-{:02d}'.format(rnd.randint(1940, 2005), rnd.randint(1, 12),
+                                             rnd.randint(1, 28))
+    if field == 'postcode':
+        return str(rnd.randint(2000, 2250))
+    if field == 'operation':
+        return rnd.choice(['I', 'U', 'D'])
+    return ''
+
+
+def generate_databank_csv(filename, rows, fields=None, multivalue=None, cjk_share=0.0,
+                          empty_share=0.1, seed=0):
+    """generate_databank_csv writes a synthetic Databank extract of rows lines.
+    multivalue gives the number of columns of a multi value field (e.g. {'phone': 2}),
+    cjk_share the share of wide and CJK values and empty_share the share of empty cells"""
+    rnd = random.Random(seed)
+    fields = fields or DEFAULT_FIELDS
+    multivalue = multivalue or {}
+    columns = []
+    for field in fields:
+        width = multivalue.get(field, len(DATABANK_COLUMNS[field]))
+        columns.extend((field, header) for header in DATABANK_COLUMNS[field][:width])
+
+    with open(filename, 'wt', encoding='UTF-8', newline='') as bench_fd:
+        writer = csv.writer(bench_fd, lineterminator='\n')
+        writer.writerow([header for _, header in columns])
+        for personid in range(rows):
+            line = []
+            for field, _ in columns:
+                if field == 'personid':
+                    line.append(str(personid))
+                elif rnd.random() < empty_share:
+                    line.append('')
+                else:
+                    line.append(synthetic_value(field, rnd, rnd.random() < cjk_share))
+            writer.writerow(line)
+    return [header for _, header in columns]
+
+
+def peak_rss_mb():
+    """peak_rss_mb returns the peak resident set size of the process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed(results, stage, rows, func):
+    """timed runs func, records its time, rows per second and peak RSS under stage"""
+    start = time.perf_counter()
+    value = func()
+    seconds = time.perf_counter() - start
+    results['stages'][stage] = {'seconds': round(seconds, 4),
+                                'rows': rows,
+                                'rows_per_sec': round(rows / seconds) if seconds else None,
+                                'peak_rss_mb': round(peak_rss_mb(), 1)}
+    print('{:<28} {:>9.3f} s {:>12} rows/s'.format(
+        stage, seconds, results['stages'][stage]['rows_per_sec']), file=sys.stderr)
+    return value
+
+
+def bench_pipeline(filename, rows, workers=1):
+    """bench_pipeline measures every stage of the pipeline on filename"""
+    results = {'stages': {}, 'normalization': {}}
+
+    def read_all():
+        with open(filename, 'rt', encoding='UTF-8') as input_fd:
+            return list(dataloader.read_csv(input_fd, ','))
+    lines = timed(results, 'read_csv', rows, read_all)
+    headers, lines = lines[0], lines[1:]
+    timed(results, 'parse_headers', 1, lambda: dataloader.parse_headers(headers))
+    timed(results, 'parse_line', rows, lambda: [dataloader.parse_line(line) for line in lines])
+
+    # normalize and senate_hash per normalization method, over the values of its columns
+    for pos, _, _, _ in dataloader.ROW_PLAN:
+        field = dataloader.DATABANK_HEADERS[headers[pos]]['match']
+        method = dataloader.DATABANK_SENATE_MATCHING_MAPPING[field]['normalization']
+        values = [line[pos] for line in lines]
+        start = time.perf_counter()
+        normalized = [dataloader.normalize(value, method) for value in values]
+        normalize_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        for value in normalized:
+            if value:
+                dataloader.senate_hash(field, value)
+        hash_seconds = time.perf_counter() - start
+        # Same work through the batch API, a column at a time
+        start = time.perf_counter()
+        normalized = dataloader.normalize_column(values, method)
+        normalize_column_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        dataloader.senate_hash_column(field, normalized)
+        hash_column_seconds = time.perf_counter() - start
+
+        stats = results['normalization'].setdefault(method, {'values': 0, 'normalize_seconds': 0,
+                                                             'senate_hash_seconds': 0,
+                                                             'normalize_column_seconds': 0,
+                                                             'senate_hash_column_seconds': 0})
+        stats['values'] += len(values)
+        stats['normalize_seconds'] += normalize_seconds
+        stats['senate_hash_seconds'] += hash_seconds
+        stats['normalize_column_seconds'] += normalize_column_seconds
+        stats['senate_hash_column_seconds'] += hash_column_seconds
+    for method, stats in sorted(results['normalization'].items()):
+        stats['normalize_values_per_sec'] = round(stats['values'] / stats['normalize_seconds']) \
+            if stats['normalize_seconds'] else None
+        stats['senate_hash_values_per_sec'] = round(stats['values'] / stats['senate_hash_seconds']) \
+            if stats['senate_hash_seconds'] else None
+        for column_stage in ['normalize_column', 'senate_hash_column']:
+            seconds = stats[column_stage + '_seconds']
+            stats[column_stage + '_values_per_sec'] = round(stats['values'] / seconds) \
+                if seconds else None
+        print('normalize {:<18} {:>9.3f} s {:>12} values/s, senate_hash {:>12} values/s'.format(
+            method, stats['normalize_seconds'], stats['normalize_values_per_sec'],
+            stats['senate_hash_values_per_sec']), file=sys.stderr)
+        print('  by column {:<16} {:>9.3f} s {:>12} values/s, senate_hash {:>12} values/s'.format(
+            '', stats['normalize_column_seconds'], stats['normalize_column_values_per_sec'],
+            stats['senate_hash_column_values_per_sec']), file=sys.stderr)
+    del lines
+
+    buf_filename = dataloader.HITCH_BUF_FILENAME
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataloader.HITCH_BUF_FILENAME = os.path.join(tmp_dir, 'bench.csv')
+        try:
+            def generate():
+                with open(filename, 'rt', encoding='UTF-8') as input_fd:
+                    return dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ','), workers)
+            timed(results, 'generate_hitch_csv', rows, generate)
+            results['stages']['generate_hitch_csv']['bytes_written'] = \
+                os.path.getsize(dataloader.HITCH_BUF_FILENAME)
+        finally:
+            dataloader.HITCH_BUF_FILENAME = buf_filename
+    return results
+
+
+def legacy_filter_and_translator(input_str, filters, translate_to_chars):
+    """legacy_filter_and_translator is the character loop filter_and_translator replaced"""
+    new_buf = ''
+    for c_input_str in input_str:
+        f_count = 0
+        for c_filter in filters:
+            if c_input_str == c_filter:
+                if f_count < len(translate_to_chars):
+                    new_buf += translate_to_chars[f_count]
+                else:
+                    new_buf += c_input_str
+            f_count += 1
+    return new_buf
+
+
+def per_value_ns(func, values, number=20000):
+    """per_value_ns returns the best time in nanoseconds of func over a single value"""
+    timer = timeit.Timer(lambda: [func(value) for value in values])
+    return min(timer.repeat(repeat=5, number=number)) / (number * len(values)) * 1e9
+
+
+def bench_phone():
+    """bench_phone measures the per value cost of the phone normalization"""
+    results = {
+        'normalize_phone': per_value_ns(dataloader.normalize_phone, PHONE_VALUES),
+        'filter_and_translator': per_value_ns(
+            lambda value: dataloader.filter_and_translator(value, dataloader.PHONE_FILTER,
+                                                           dataloader.PHONE_TRANSLATION),
+            PHONE_VALUES),
+        'legacy_filter_and_translator': per_value_ns(
+            lambda value: legacy_filter_and_translator(dataloader.to_narrow(value),
+                                                       dataloader.PHONE_FILTER,
+                                                       dataloader.PHONE_TRANSLATION),
+            PHONE_VALUES, number=2000),
+    }
+    for name in results:
+        print('{:<30} {:>10.0f} ns/value'.format(name, results[name]), file=sys.stderr)
+    return {name: round(results[name]) for name in results}
+
+
+def bench_startup(runs=5):
+    """bench_startup measures with python -X importtime the best import time of dataloader
+    over runs, and the modules it spends the most on, plus the wall time of dataloader.py --help"""
+    root = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+    import_us, modules = None, {}
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import dataloader'],
+                                cwd=root, stderr=subprocess.PIPE, check=True)
+        # Modules are listed after the ones they import, top level ones without indent
+        cumulative = {}
+        for line in result.stderr.decode('utf-8').splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                _, cumulative_us, name = line.split(':', 1)[1].split('|')
+                if name.strip() == 'dataloader':
+                    break
+                cumulative[name.strip()] = int(cumulative_us)
+                if not name[1:].startswith(' '):
+                    cumulative = {}
+        if import_us is None or int(cumulative_us) < import_us:
+            import_us, modules = int(cumulative_us), cumulative
+    help_seconds = min(timeit.repeat(
+        lambda: subprocess.run([sys.executable, os.path.join(root, 'dataloader.py'), '--help'],
+                               stdout=subprocess.DEVNULL, check=True), repeat=runs, number=1))
+    results = {
+        'import_ms': round(import_us / 1000, 1),
+        'help_ms': round(help_seconds * 1000, 1),
+        'top_imports_ms': {name: round(modules[name] / 1000, 1) for name in
+                           sorted(modules, key=modules.get, reverse=True)[:5]},
+    }
+    print('{:<30} {:>10.1f} ms'.format('import dataloader', results['import_ms']), file=sys.stderr)
+    print('{:<30} {:>10.1f} ms'.format('dataloader.py --help', results['help_ms']), file=sys.stderr)
+    return results
+
+
+def parse_multivalue(raw):
+    """parse_multivalue parses field=width pairs, e.g. phone=2,email=1"""
+    multivalue = {}
+    for pair in filter(None, raw.split(',')):
+        field, width = pair.split('=')
+        multivalue[field] = int(width)
+    return multivalue
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the dataloader.py pipeline on a synthetic '
+                                                 'Databank extract')
+    parser.add_argument('--rows', type=int, default=100000, help='Lines of the synthetic extract')
+    parser.add_argument('--fields', default=','.join(DEFAULT_FIELDS),
+                        help='Comma separated Senate Matching fields of the synthetic extract')
+    parser.add_argument('--multivalue', default='',
+                        help='Columns per multi value field, e.g. phone=2,email=1')
+    parser.add_argument('--cjk-share', type=float, default=0.1,
+                        help='Share of wide and CJK values, between 0 and 1')
+    parser.add_argument('--workers', type=int, default=1, help='Workers of generate_hitch_csv')
+    parser.add_argument('--hash-cache', type=float, default=0,
+                        help='Memory ceiling in MB of the hash cache, disabled by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', type=argparse.FileType('wt', encoding='UTF-8'),
+                        help='Write the results as JSON to this file')
+    args = parser.parse_args()
+
+    dataloader.logger.setLevel(logging.ERROR)
+    stub_salts()
+    dataloader.configure_hash_cache(args.hash_cache)
+    with tempfile.TemporaryDirectory() as bench_dir:
+        bench_filename = os.path.join(bench_dir, 'databank.csv')
+        bench_headers = generate_databank_csv(bench_filename, args.rows, args.fields.split(','),
+                                              parse_multivalue(args.multivalue), args.cjk_share,
+                                              seed=args.seed)
+        bench_results = {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': {'rows': args.rows, 'headers': bench_headers,
+                           'cjk_share': args.cjk_share, 'workers': args.workers,
+                           'hash_cache': args.hash_cache,
+                           'seed': args.seed, 'bytes': os.path.getsize(bench_filename)},
+        }
+        bench_results.update(bench_pipeline(bench_filename, args.rows, args.workers))
+    bench_results['phone_ns_per_value'] = bench_phone()
+    bench_results['startup'] = bench_startup()
+    bench_results['peak_rss_mb'] = round(peak_rss_mb(), 1)
+    bench_results['hash_cache'] = dict(zip(['hits', 'misses'], dataloader.hash_cache_counters()))
+
+    if args.json:
+        json.dump(bench_results, args.json, indent=2, sort_keys=True)
+    else:
+        json.dump(bench_results, sys.stdout, indent=2, sort_keys=True)
+        print()
@@ -2,7 +2,19 @@
 # -*- coding: utf-8 -*-
 """unit tests for dataloader.py"""
 
+import argparse
+import asyncio
+import csv
+import gzip
+import http.server
+import io
+import json
 import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 from requests.auth import HTTPBasicAuth
 import dataloader
@@ -27,9 +39,75 @@ def is_int(value):
     return True
 
 
+class StandInContributorNode(http.server.BaseHTTPRequestHandler):
+    """StandInContributorNode answers GlobalConfig, LoadHashedRecords and GetPersonTokens
+    as a Contributor Node does. server.failures gives the number of 503 to answer first,
+    per path, and server.delay the seconds to wait before every answer"""
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self, payload):
+        path = self.path.split('?')[0]
+        self.server.paths.append(path)
+        self.server.ports.add(self.client_address[1])
+        time.sleep(self.server.delay)
+        status = 200
+        if self.server.failures.get(path, 0):
+            self.server.failures[path] -= 1
+            status, payload = 503, {'error': 'unavailable', 'code': 503}
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/GlobalConfig'):
+            self.answer({'Fields': {'1': {'FieldName': 'email', 'HashSalt': 'standin'}},
+                         'FieldQualifiers': {}})
+        else:
+            self.answer([{'PersonId': '1', 'Token': 'token1'}])
+
+    def do_POST(self):
+        if self.headers.get('Transfer-Encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if not size:
+                    break
+            body = b''.join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers['Content-Length']))
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        self.server.bodies.append(body)
+        self.answer({})
+
+    def log_message(self, *args):
+        pass
+
+
 class TestDataLoader(unittest.TestCase):
     """DataLoader Test Class"""
 
+    def start_contributor_node(self, failures=None, delay=0):
+        """start_contributor_node serves a StandInContributorNode until the end of the test,
+        and returns the server and its URL"""
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInContributorNode)
+        server.failures = failures or {}
+        server.delay = delay
+        server.paths = []
+        server.ports = set()
+        server.bodies = []
+        # The timed out and cut short requests hang up before their answer
+        server.handle_error = lambda request, client_address: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
     def test_find_matching_field(self):
         """test_find_matching_field"""
         for al_tuple in list_of_aliases():
@@ -70,8 +148,6 @@ class TestDataLoader(unittest.TestCase):
             self.assertEqual(expected, result)
 
     def test_normalization_other(self):
-        self.assertEqual(os.path.exists('./toNarrow'), True, 'missing toNarrow binary [go build toNarrow.go]')
-
         localpath = os.path.dirname(os.path.realpath(__file__))
         tree = ET.parse('{}/fixtures/normalize_other.xml'.format(localpath))
         root = tree.getroot()
@@ -86,6 +162,44 @@ class TestDataLoader(unittest.TestCase):
             self.assertEqual(dataloader.normalize(input, method), expected, "input: {} method: {} expected: {}".format(input, method, expected))
 
 
+    def test_to_narrow_parity(self):
+        """test_to_narrow_parity compares to_narrow with the toNarrow.go output on the fixtures"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        exe = os.path.join(localpath, '..', 'tonarrow')
+        if not os.access(exe, os.X_OK):
+            self.skipTest('missing tonarrow binary [make go]')
+
+        inputs = []
+        for fixture in ['normalize_name.xml', 'normalize_other.xml']:
+            root = ET.parse('{}/fixtures/{}'.format(localpath, fixture)).getroot()
+            inputs.extend(elem[0].text for elem in root if elem[0].text)
+        # A single tonarrow process converts every fixture, one value per line
+        inputs = [value for value in inputs if '\n' not in value]
+        result = subprocess.run(exe, stdout=subprocess.PIPE, check=True,
+                                input='\n'.join(inputs).encode('utf-8'))
+        expected = result.stdout.decode('utf-8').split('\n')
+        for value, narrow in zip(inputs, expected):
+            self.assertEqual(dataloader.to_narrow(value), narrow, 'input: {}'.format(value))
+
+    def test_to_narrow(self):
+        """test_to_narrow"""
+        self.assertEqual(dataloader.to_narrow('Ｕｓｅｒ＠Ｄｏｍａｉｎ．Ｃｏｍ\u3000１２３'),
+                         'User@Domain.Com 123')
+        self.assertEqual(dataloader.to_narrow('アイウ、「」￥'), 'ｱｲｳ､｢｣¥')
+        self.assertEqual(dataloader.to_narrow('ｱｲｳ mcmahon'), 'ｱｲｳ mcmahon')
+
+        # Wide values are normalized to their narrow form, primary key included. Earlier
+        # versions never found the tonarrow binary and hashed them as they were
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        try:
+            dataloader.parse_headers(['personid', 'email'])
+            self.assertEqual(dataloader.parse_line(['ＡＢ１２', 'Ｕｓｅｒ＠Ｄｏｍａｉｎ．Ｃｏｍ']),
+                             ['AB12', 'euH0LtcPsUInnjUsCcdGF9cjMpPKyoWJpbl59QbLhyd642VYYxN48QgNfRkD8Bpmi'
+                                      'c+M/LbF9LKJpOu4IHyovg=='])
+        finally:
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+
     @responses.activate
     def test_retrieve_salts(self):
         """test_retrieve_salts"""
@@ -155,6 +269,901 @@ class TestDataLoader(unittest.TestCase):
                                                 }
                                             )
 
+    def test_parse_line(self):
+        """test_parse_line runs the ROW_PLAN built by parse_headers"""
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        self.assertEqual(dataloader.parse_headers(['junk', 'email', 'natural_key', 'postcode']),
+                         ['email', 'personid', 'postcode'])
+        self.assertEqual([entry[:2] for entry in dataloader.ROW_PLAN],
+                         [(1, 'email'), (2, 'personid'), (3, 'postcode')])
+        self.assertEqual(dataloader.parse_line(['x', ' Any Thing ', 'Ｐ１', '']),
+                         [dataloader.senate_hash('email', 'anything'), 'P1', ''])
+        self.assertEqual(dataloader.parse_line(['x', ' ', '', '-']), None)
+
+    def test_column_api(self):
+        """test_column_api makes sure the batch API gives the same values as normalize
+        and senate_hash, and parse_columns the same lines as parse_line"""
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        values = [' Any Thing ', '', 'ＡＢＣ@example.com', ' Any Thing ', ' ']
+        normalized = dataloader.normalize_column(values, 'email')
+        self.assertEqual(normalized, [dataloader.normalize(value, 'email') for value in values])
+        self.assertEqual(dataloader.senate_hash_column('email', normalized),
+                         [dataloader.senate_hash('email', value) if value else value
+                          for value in normalized])
+        self.assertEqual(dataloader.senate_hash_column('operation', ['D', '']), ['D', ''])
+        dataloader.parse_headers(['email', 'natural_key'])
+        lines = [[value, str(count)] for count, value in enumerate(values)] + [[' ', '']]
+        self.assertEqual([list(line) for line in dataloader.parse_columns(dataloader.line_columns(lines))],
+                         [dataloader.parse_line(line) for line in lines if dataloader.parse_line(line)])
+        self.assertEqual(dataloader.parse_columns(dataloader.line_columns([])), [])
+
+    def test_generate_hitch_csv_workers(self):
+        """test_generate_hitch_csv_workers makes sure the worker pool writes the
+        same buffer as a single process"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['phone']['salt'] = 'ff14d4eff61149c193d5b212f2c2d15b'
+        batch_rows = dataloader.BATCH_ROWS
+        dataloader.BATCH_ROWS = 1
+        buffers = []
+        try:
+            for workers in [1, 2]:
+                with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                    self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ','), workers))
+                with open(dataloader.HITCH_BUF_FILENAME, 'rb') as hitch_buf_fd:
+                    buffers.append(hitch_buf_fd.read())
+        finally:
+            dataloader.BATCH_ROWS = batch_rows
+            dataloader.clean_buf_env()
+        self.assertEqual(buffers[0].count(b'\r\n'), 4)
+        self.assertEqual(buffers[0], buffers[1])
+
+        # The workers hash with the mapping and salts of the Loader, not the module ones
+        mapping = json.loads(json.dumps(dataloader.DATABANK_SENATE_MATCHING_MAPPING))
+        mapping['email'].update(normalization='uppercase', salt='custom')
+        del mapping['phone']['salt']
+        loader = dataloader.Loader(mapping)
+        content = 'personid,email,phone\n1,a@b.c,0412345678\n2,d@e.f,\n'
+        buffers = []
+        try:
+            with loader.activate():
+                for workers in [1, 2]:
+                    self.assertTrue(dataloader.generate_hitch_csv(
+                        dataloader.read_csv(io.StringIO(content), ','), workers))
+                    with open(loader.buf_filename, 'rb') as hitch_buf_fd:
+                        buffers.append(hitch_buf_fd.read())
+                dataloader.clean_buf_env()
+        finally:
+            loader.close()
+        self.assertEqual(buffers[0], buffers[1])
+        self.assertIn(dataloader.salted_hash('A@B.C', b'custom').encode('utf-8'), buffers[1])
+        # Phone has no salt in the Loader mapping: only the emails are digests
+        self.assertEqual(buffers[1].count(b'=='), 2)
+
+    def test_csv2hitchcsv(self):
+        """test_csv2hitchcsv hashes offline the same lines as generate_hitch_csv, and
+        refuses to hash a field without salt"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        sys.path.insert(0, os.path.join(localpath, '..', 'utils'))
+        try:
+            import csv2hitchcsv
+        finally:
+            sys.path.pop(0)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            salts_filename = os.path.join(tmpdir, 'salts.json')
+            with open(salts_filename, 'wt', encoding='UTF-8') as salts_fd:
+                json.dump({'email': '9da8b01a3ab64fcc8e39ebd5c4cf21e7',
+                           'phone': 'ff14d4eff61149c193d5b212f2c2d15b'}, salts_fd)
+            csv2hitchcsv.load_salts(salts_filename)
+        try:
+            with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ',')))
+            with open(dataloader.HITCH_BUF_FILENAME, 'rt', encoding='UTF-8', newline='') as hitch_buf_fd:
+                expected = hitch_buf_fd.read()
+            output = io.StringIO()
+            with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                self.assertTrue(csv2hitchcsv.hash_csv(dataloader.read_csv(input_fd, ','), output))
+            self.assertEqual(output.getvalue(), expected)
+            self.assertFalse(csv2hitchcsv.hash_csv(
+                dataloader.read_csv(io.StringIO('personid,postcode\n1,2000\n'), ','), io.StringIO()))
+
+            # Multi value output is loaded unchanged by --hashed
+            content = 'personid,contact_mobile_number,alternate_mobile_number,email,alternate_email_address\n' \
+                      '1,0412 345 678,+61 413 000 000,a@b.c,\n2,,0414000000,,d@e.f\n'
+            output = io.StringIO()
+            self.assertTrue(csv2hitchcsv.hash_csv(dataloader.read_csv(io.StringIO(content), ','), output))
+            self.assertEqual(output.getvalue().splitlines()[0], 'personid,phone:0,phone:1,email:0,email:1')
+            dataloader.HASHED_INPUT = True
+            self.assertTrue(dataloader.generate_hitch_csv(
+                dataloader.read_csv(io.StringIO(output.getvalue(), newline=''), ',')))
+            with open(dataloader.HITCH_BUF_FILENAME, 'rt', encoding='UTF-8', newline='') as hitch_buf_fd:
+                self.assertEqual(hitch_buf_fd.read(), output.getvalue())
+        finally:
+            dataloader.HASHED_INPUT = False
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+            dataloader.clean_buf_env()
+
+    def test_hashed_input(self):
+        """test_hashed_input maps the headers of a pre-hashed file, keeps its values as is
+        and rejects the values that are not a digest"""
+        digest = dataloader.salted_hash('a@b.c', b'9da8b01a3ab64fcc8e39ebd5c4cf21e7')
+        dataloader.HASHED_INPUT = True
+        try:
+            content = 'natural_key,contact_email_address,operation\n' \
+                      ' A1 ,{0},D\n2,,\n'.format(digest)
+            self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(io.StringIO(content), ',')))
+            with open(dataloader.HITCH_BUF_FILENAME, 'rt', encoding='UTF-8') as hitch_buf_fd:
+                self.assertEqual(list(csv.reader(hitch_buf_fd)),
+                                 [['personid', 'email', 'operation'], ['A1 ', digest, 'D'], ['2', '', '']])
+            # The output keys of multi value fields are kept, unexpected headers are rejected
+            content = 'personid,phone:0,phone:1,email\n1,{0},{0},\n2,,{0},{0}\n'.format(digest)
+            self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(io.StringIO(content), ',')))
+            with open(dataloader.HITCH_BUF_FILENAME, 'rt', encoding='UTF-8', newline='') as hitch_buf_fd:
+                self.assertEqual(hitch_buf_fd.read().replace('\r\n', '\n'), content)
+            for headers in ['personid,email,junk', 'personid,phone:', 'personid,phone:a']:
+                content = '{}\n1,{},x\n'.format(headers, digest)
+                self.assertFalse(dataloader.generate_hitch_csv(dataloader.read_csv(io.StringIO(content), ',')))
+            for value in ['a@b.c', digest[:-1], digest[:-2] + '=A', digest + 'A']:
+                content = 'personid,email\n1,{}\n'.format(value)
+                self.assertFalse(dataloader.generate_hitch_csv(dataloader.read_csv(io.StringIO(content), ',')))
+        finally:
+            dataloader.HASHED_INPUT = False
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+            dataloader.clean_buf_env()
+
+    def test_pipeline_stages(self):
+        """test_pipeline_stages keeps the order of the reader and writer stages and raises
+        the reader errors, including exit(), in the consumer"""
+        self.assertEqual(list(dataloader.prefetch(iter(range(100)), 2)), list(range(100)))
+
+        def failing_reader():
+            yield 1
+            sys.exit(1)
+        with self.assertRaises(SystemExit):
+            list(dataloader.prefetch(failing_reader(), 2))
+
+        written = []
+        writer = dataloader.BackgroundWriter(written.append, 2)
+        for data in range(100):
+            writer.write(data)
+        writer.close()
+        self.assertEqual(written, list(range(100)))
+
+    def test_delta_index(self):
+        """test_delta_index only keeps the lines changed since the committed load
+        and deletes the personids gone since then"""
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        self.assertEqual(dataloader.senate_hash('operation', 'D'), 'D')
+
+        def load(content, commit=True):
+            delta = dataloader.DeltaIndex(index_filename, 'dbuuid')
+            self.assertTrue(dataloader.generate_hitch_csv(
+                dataloader.read_csv(io.StringIO(content), ','), delta=delta))
+            if commit:
+                delta.commit()
+            delta.close()
+            with open(dataloader.HITCH_BUF_FILENAME, 'rt', encoding='UTF-8') as hitch_buf_fd:
+                return list(csv.reader(hitch_buf_fd))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            index_filename = os.path.join(tmpdir, 'delta.sqlite')
+            try:
+                first = load('personid,email\n1,a@b.c\n2,d@e.f\n3,g@h.i\n')
+                self.assertEqual(first[0], ['personid', 'email', 'operation'])
+                self.assertEqual([row[0] for row in first[1:]], ['1', '2', '3'])
+                # Nothing is recorded without commit
+                self.assertEqual(len(load('personid,email\n1,a@b.c\n', commit=False)), 3)
+                second = load('personid,email\n1,a@b.c\n2,x@e.f\n4,j@k.l\n')
+                self.assertEqual(second[1:], [['2', dataloader.senate_hash('email', 'x@e.f'), ''],
+                                              ['4', dataloader.senate_hash('email', 'j@k.l'), ''],
+                                              ['3', '', 'D']])
+                self.assertEqual(load('personid,email,operation\n1,a@b.c,D\n2,x@e.f,\n'),
+                                 [['personid', 'email', 'operation'],
+                                  ['1', dataloader.senate_hash('email', 'a@b.c'), 'D'],
+                                  ['4', '', 'D']])
+                # Personids deleted by the input are not deleted again
+                self.assertEqual(load('personid,email,operation\n2,x@e.f,\n')[1:], [])
+            finally:
+                dataloader.clean_buf_env()
+                dataloader.DATABANK_HEADERS.clear()
+                dataloader.MATCH.clear()
+
+    def test_transport(self):
+        """test_transport retries, times out and multiplexes requests over pooled
+        connections to a stand-in Contributor Node"""
+        server, hostname = self.start_contributor_node({'/GlobalConfig': 1, '/LoadHashedRecords': 1})
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                hashed_filename = os.path.join(tmpdir, 'hashed.csv')
+                with open(hashed_filename, 'wt', encoding='UTF-8') as hashed_fd:
+                    hashed_fd.write('personid,email\r\n1,hash\r\n')
+
+                dataloader.configure_transport(backoff=0)
+                self.assertTrue(dataloader.retrieve_salts(hostname, auth, False))
+                self.assertEqual(dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'], 'standin')
+                self.assertEqual(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False,
+                                                                hashed_filename), 200)
+                self.assertEqual(server.paths, ['/GlobalConfig'] * 2 + ['/LoadHashedRecords'] * 2)
+                # Keep-alive connections are reused
+                self.assertEqual(len(server.ports), 1)
+                output = io.StringIO()
+                self.assertEqual(dataloader.stream_loaded_tokens(hostname, 'dbuuid', auth, output, False),
+                                 (1, True))
+
+                self.assertEqual(asyncio.run(dataloader.load_hashed_files(
+                    hostname, 'dbuuid', auth, False, [hashed_filename] * 3)), [200] * 3)
+
+                # Uploads that timed out are not sent again, GET requests are
+                dataloader.configure_transport(read_timeout=0.1, backoff=0)
+                server.delay = 0.5
+                server.paths.clear()
+                self.assertGreater(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False,
+                                                                  hashed_filename), 399)
+                self.assertFalse(dataloader.retrieve_salts(hostname, auth, False))
+                self.assertEqual(server.paths, ['/LoadHashedRecords'] + ['/GlobalConfig'] * 6)
+        finally:
+            dataloader.configure_transport()
+
+    @responses.activate
+    def test_compressed_upload(self):
+        """test_compressed_upload gzips the uploads and the buffer file, and falls back
+        to plain uploads once the Contributor Node rejected a compressed one"""
+        hostname = 'http://localhost/'
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['phone']['salt'] = 'ff14d4eff61149c193d5b212f2c2d15b'
+        for status in [200, 415, 200]:
+            responses.add(responses.POST, hostname + 'LoadHashedRecords', status=status)
+        dataloader.configure_transport(retries=0)
+
+        buffers = []
+        try:
+            for compression in [False, True]:
+                dataloader.BUFFER_COMPRESSION = compression
+                with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                    self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ',')))
+                with dataloader.open_hitch_buf('rb') as hitch_buf_fd:
+                    buffers.append(hitch_buf_fd.read())
+                with open(dataloader.HITCH_BUF_FILENAME, 'rb') as hitch_buf_fd:
+                    self.assertEqual(hitch_buf_fd.read(2) == b'\x1f\x8b', compression)
+                dataloader.UPLOAD_COMPRESSION = 'gzip'
+                self.assertEqual(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False), 200)
+        finally:
+            dataloader.BUFFER_COMPRESSION = False
+            dataloader.UPLOAD_COMPRESSION = None
+            dataloader.clean_buf_env()
+        self.assertEqual(buffers[0], buffers[1])
+
+        encodings = [call.request.headers.get('Content-Encoding') for call in responses.calls]
+        self.assertEqual(encodings, ['gzip', 'gzip', None])
+        self.assertIn(buffers[0], gzip.decompress(responses.calls[0].request.body))
+        self.assertEqual(gzip.decompress(responses.calls[1].request.body),
+                         responses.calls[2].request.body)
+
+    def test_stream_uploader(self):
+        """test_stream_uploader sends the same file as the buffer file in a single chunked
+        request, and cuts it short on an invalid line"""
+        server, hostname = self.start_contributor_node()
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['phone']['salt'] = 'ff14d4eff61149c193d5b212f2c2d15b'
+        try:
+            with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ',')))
+            with open(dataloader.HITCH_BUF_FILENAME, 'rb') as hitch_buf_fd:
+                hitch_buf = hitch_buf_fd.read()
+            for compression in [None, 'gzip']:
+                dataloader.UPLOAD_COMPRESSION = compression
+                uploader = dataloader.StreamUploader(hostname, 'dbuuid', auth, False)
+                with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+                    self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ','),
+                                                                  uploader=uploader))
+                self.assertEqual(uploader.close(), 200)
+                self.assertIn(b'\r\n\r\n' + hitch_buf + b'\r\n--', server.bodies[-1])
+
+            dataloader.UPLOAD_COMPRESSION = None
+            uploader = dataloader.StreamUploader(hostname, 'dbuuid', auth, False)
+            self.assertFalse(dataloader.generate_hitch_csv(
+                dataloader.read_csv(io.StringIO('personid,email\n1,a@b.c\n2\n'), ','),
+                uploader=uploader))
+            self.assertEqual(uploader.close(), 500)
+            self.assertEqual(len(server.bodies), 2)
+        finally:
+            dataloader.UPLOAD_COMPRESSION = None
+            dataloader.clean_buf_env()
+
+    def test_batch(self):
+        """test_batch runs the loads of a manifest concurrently, retrieving the salts once"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        result = subprocess.run([sys.executable, os.path.join(localpath, '..', 'dataloader.py'),
+                                 '--batch', 'manifest.json', '--workers', '2'],
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn('cannot be combined with --workers', result.stderr)
+        server, hostname = self.start_contributor_node()
+        options = {'mmap': False, 'workers': 1, 'hash_cache': 1, 'chunk_rows': 0,
+                   'parallel_uploads': 1, 'resume': False, 'stream': False, 'delta': None,
+                   'timeout': 10, 'retries': 0, 'ca_verify': False, 'input_format': 'csv',
+                   'output_format': 'csv', 'hashed_output': None}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            os.mkdir(os.path.join(tmpdir, 'extracts'))
+            for name, content in [('extracts/a.csv', 'personid,email\n1,a@b.c\n'),
+                                  ('extracts/b.csv', 'personid,email\n2,d@e.f\n'),
+                                  ('c.csv', 'personid;email\n3;g@h.i\n'),
+                                  ('invalid.csv', 'personid,email\n4\n')]:
+                with open(os.path.join(tmpdir, name), 'wt', encoding='UTF-8') as csv_fd:
+                    csv_fd.write(content)
+            manifest_filename = os.path.join(tmpdir, 'manifest.json')
+            with open(manifest_filename, 'wt', encoding='UTF-8') as manifest_fd:
+                json.dump([{'input': 'extracts', 'uuid': 'dbuuid1'},
+                           {'input': 'c.csv', 'uuid': 'dbuuid2', 'delimiter': ';',
+                            'output': 'c_tokens.csv'},
+                           {'input': 'invalid.csv', 'uuid': 'dbuuid2'}], manifest_fd)
+
+            jobs = dataloader.read_batch_manifest(manifest_filename)
+            self.assertEqual([(os.path.relpath(job['input'], tmpdir), job['uuid'], job['delimiter'],
+                               os.path.relpath(job['output'], tmpdir)) for job in jobs],
+                             [('extracts/a.csv', 'dbuuid1', ',', 'extracts/a.csv.mapping.csv'),
+                              ('extracts/b.csv', 'dbuuid1', ',', 'extracts/b.csv.mapping.csv'),
+                              ('c.csv', 'dbuuid2', ';', 'c_tokens.csv'),
+                              ('invalid.csv', 'dbuuid2', ',', 'invalid.csv.mapping.csv')])
+
+            # String truth values are not taken as true
+            for hashed, expected in [(True, True), ('false', False), ('0', False), ('yes', True)]:
+                with open(manifest_filename, 'wt', encoding='UTF-8') as manifest_fd:
+                    json.dump([{'input': 'c.csv', 'uuid': 'dbuuid2', 'hashed': hashed}], manifest_fd)
+                self.assertEqual(dataloader.read_batch_manifest(manifest_filename)[0]['hashed'], expected)
+            for hashed in ['maybe', 0, None]:
+                with open(manifest_filename, 'wt', encoding='UTF-8') as manifest_fd:
+                    json.dump([{'input': 'c.csv', 'uuid': 'dbuuid2', 'hashed': hashed}], manifest_fd)
+                with self.assertRaises(ValueError):
+                    dataloader.read_batch_manifest(manifest_filename)
+
+            results = dataloader.run_batch(jobs, options, hostname, 'passw0rd', parallel_jobs=2)
+            self.assertEqual([(result['exit_code'], result['tokens']) for result in results],
+                             [(0, 1), (0, 1), (0, 1), (1, 0)])
+            with open(os.path.join(tmpdir, 'c_tokens.csv'), 'rt', encoding='UTF-8') as tokens_fd:
+                self.assertEqual(tokens_fd.read(), 'personid,token\n1,token1\n')
+            summary = io.StringIO()
+            dataloader.write_batch_summary(summary, results)
+            self.assertEqual(summary.getvalue().splitlines()[0],
+                             'input,uuid,output,exit_code,tokens,seconds')
+        self.assertEqual(server.paths.count('/GlobalConfig'), 1)
+        self.assertEqual(server.paths.count('/LoadHashedRecords'), 3)
+
+    def test_loader(self):
+        """test_loader runs loads into two DBUUIDs concurrently, each Loader hashing with its
+        own salts and headers, without touching the module state"""
+        server, hostname = self.start_contributor_node(delay=0.2)
+        options = {'mmap': False, 'workers': 1, 'hash_cache': 1, 'chunk_rows': 0,
+                   'parallel_uploads': 1, 'resume': False, 'delta': None, 'timeout': 10,
+                   'retries': 0, 'input_format': 'csv', 'output_format': 'csv',
+                   'hashed_output': None}
+        default_salts = dataloader.field_salts()
+        loads = [('a.csv', 'personid,email,postcode\n1,a@b.c,2000\n', 'dbuuid1', 'salt-a', False),
+                 ('b.csv', 'natural_key,phone,email,postcode\n2,0412345678,d@e.f,2000\n', 'dbuuid2',
+                  'salt-b', True)]
+        results = {}
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def load(name, content, uuid, salt, stream):
+                loader = dataloader.Loader()
+                loader.set_salts({'email': salt, 'phone': salt, 'postcode': salt})
+                with open(os.path.join(tmpdir, name), 'wt', encoding='UTF-8') as csv_fd:
+                    csv_fd.write(content)
+                with open(os.path.join(tmpdir, name), 'rt', encoding='UTF-8') as input_fd, \
+                        open(os.path.join(tmpdir, name + '.mapping.csv'), 'wt',
+                             encoding='UTF-8') as output_fd:
+                    args = argparse.Namespace(input=input_fd, output=output_fd, uuid=uuid,
+                                              delimiter=',', hashed=False, stream=stream,
+                                              **options)
+                    results[name] = loader.load(args, hostname, HTTPBasicAuth('api', 'passw0rd'),
+                                                False, salts_retrieved=True)
+                results[name + ' match'] = dict(loader.match)
+                with loader.activate():
+                    results[name + ' hash cache'] = dataloader.hash_cache_counters()
+                self.assertFalse(os.path.exists(loader.buf_filename))
+                loader.close()
+
+            threads = [threading.Thread(target=load, args=job) for job in loads]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(results['a.csv'], (0, 1))
+        self.assertEqual(results['b.csv'], (0, 1))
+        self.assertEqual(results['a.csv match'], {'personid': 'personid', 'email': 'email',
+                                                  'postcode': 'postcode'})
+        self.assertEqual(results['b.csv match'], {'natural_key': 'personid', 'phone': 'phone',
+                                                  'email': 'email', 'postcode': 'postcode'})
+        # The hash cache counters of a load are not reset by the other one
+        self.assertEqual(results['a.csv hash cache'], (0, 1))
+        self.assertEqual(results['b.csv hash cache'], (0, 1))
+        self.assertEqual(server.paths.count('/LoadHashedRecords'), 2)
+        self.assertEqual(server.paths.count('/GlobalConfig'), 0)
+        digests = {name: dataloader.salted_hash(email, salt.encode('utf-8'))
+                   for name, email, salt in [('a.csv', 'a@b.c', 'salt-a'),
+                                             ('b.csv', 'd@e.f', 'salt-b')]}
+        for body in server.bodies:
+            name = 'a.csv' if b'filename="a.csv"' in body else 'b.csv'
+            self.assertIn('filename="{}"'.format(name).encode('utf-8'), body)
+            self.assertIn(digests[name].encode('utf-8'), body)
+            self.assertEqual(body.count(b'=='), 2 if name == 'a.csv' else 3)
+        self.assertEqual(dataloader.field_salts(), default_salts)
+
+        # A load stopped by an invalid line leaves no upload in flight and closes its index
+        uploaders = []
+        indexes = []
+
+        class StreamUploader(dataloader.StreamUploader):
+            def __init__(self, *args):
+                super().__init__(*args)
+                uploaders.append(self)
+
+        class ChunkUploader(dataloader.ChunkUploader):
+            def __init__(self, *args):
+                super().__init__(*args)
+                uploaders.append(self)
+
+        class DeltaIndex(dataloader.DeltaIndex):
+            def __init__(self, *args):
+                super().__init__(*args)
+                indexes.append(self)
+
+        classes = dataloader.StreamUploader, dataloader.ChunkUploader, dataloader.DeltaIndex
+        dataloader.StreamUploader, dataloader.ChunkUploader, dataloader.DeltaIndex = \
+            StreamUploader, ChunkUploader, DeltaIndex
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for stream, chunk_rows in [(True, 0), (False, 1)]:
+                    loader = dataloader.Loader()
+                    loader.set_salts({'email': 'salt-a'})
+                    args = argparse.Namespace(input=io.StringIO('personid,email\n1,a@b.c\n2\n'),
+                                              output=io.StringIO(), uuid='dbuuid1', delimiter=',',
+                                              hashed=False, stream=stream,
+                                              **dict(options, chunk_rows=chunk_rows,
+                                                     delta=os.path.join(tmpdir, 'delta.db')))
+                    self.assertEqual(loader.load(args, hostname, HTTPBasicAuth('api', 'passw0rd'),
+                                                 False, salts_retrieved=True), (1, 0))
+                    loader.close()
+        finally:
+            dataloader.StreamUploader, dataloader.ChunkUploader, dataloader.DeltaIndex = classes
+        self.assertEqual(len(uploaders), 2)
+        uploaders[0].thread.join(5)
+        self.assertFalse(uploaders[0].thread.is_alive())
+        self.assertTrue(uploaders[1].pool._shutdown)
+        self.assertEqual(len(indexes), 2)
+        for index in indexes:
+            with self.assertRaises(Exception):
+                index.connection.execute('SELECT 1')
+
+        # The headers of a previous file are not kept
+        try:
+            dataloader.parse_headers(['personid', 'email'])
+            dataloader.parse_headers(['natural_key', 'phone'])
+            self.assertEqual(set(dataloader.DATABANK_HEADERS), {'natural_key', 'phone'})
+            self.assertEqual(dataloader.MATCH, {'natural_key': 'personid', 'phone': 'phone'})
+        finally:
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+
+    def test_salt_cache(self):
+        """test_salt_cache hashes with the cached salts, and hashes again with the salts of
+        GlobalConfig when they changed since cached"""
+        server, hostname = self.start_contributor_node()
+        email_mapping = dict(dataloader.DATABANK_SENATE_MATCHING_MAPPING['email'])
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                cache_filename = os.path.join(tmpdir, 'salts.json')
+                cache = dataloader.SaltCache(cache_filename, hostname)
+                self.assertIsNone(cache.load())
+                cache.save({'email': 'cached'})
+                self.assertEqual(os.stat(cache_filename).st_mode & 0o777, 0o600)
+                self.assertEqual(cache.load(), {'email': 'cached'})
+                self.assertIsNone(dataloader.SaltCache(cache_filename, 'http://other/').load())
+                self.assertIsNone(dataloader.SaltCache(cache_filename, hostname, ttl_seconds=0).load())
+                os.chmod(cache_filename, 0o644)
+                self.assertIsNone(cache.load())
+                cache.save({'email': 'standin'})
+
+                input_filename = os.path.join(tmpdir, 'input.csv')
+                with open(input_filename, 'wt', encoding='UTF-8') as input_fd:
+                    input_fd.write('personid,email\n1,a@b.c\n')
+                for cached_salt in ['standin', 'outdated']:
+                    cache.save({'email': cached_salt})
+                    with open(input_filename, 'rt', encoding='UTF-8') as input_fd:
+                        args = argparse.Namespace(
+                            input=input_fd, output=io.StringIO(), uuid='dbuuid', delimiter=',',
+                            hashed=False, salt_cache=cache_filename, salt_cache_ttl=1, hash_cache=0,
+                            chunk_rows=0, resume=False, stream=False, delta=None, input_format='csv',
+                            mmap=False, workers=1, hashed_output=None, parallel_uploads=1,
+                            output_format='csv')
+                        self.assertEqual(dataloader.load_file(args, hostname, None, False), (0, 1))
+                    # Only lines hashed with the salts of GlobalConfig are uploaded
+                    self.assertIn(dataloader.salted_hash('a@b.c', b'standin').encode('utf-8'),
+                                  server.bodies[-1])
+                    self.assertEqual(cache.load(), {'email': 'standin'})
+            self.assertEqual(server.paths.count('/GlobalConfig'), 2)
+            self.assertEqual(server.paths.count('/LoadHashedRecords'), 2)
+        finally:
+            dataloader.DATABANK_SENATE_MATCHING_MAPPING['email'] = email_mapping
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+
+    @unittest.skipIf(dataloader.load_pyarrow() is None, 'pyarrow is not installed')
+    def test_arrow_reader(self):
+        """test_arrow_reader hashes Parquet and Arrow files as their CSV equivalent,
+        by exact batches of lines, and writes the Parquet outputs"""
+        import pyarrow
+        import pyarrow.parquet
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['phone']['salt'] = 'ff14d4eff61149c193d5b212f2c2d15b'
+        table = pyarrow.table({'natural_key': pyarrow.array(range(7), pyarrow.int64()),
+                               'junk': ['x'] * 7,
+                               'email': ['A@b.c', None, 'd@E.f', ' g@h.i', '', 'j@k.l', 'm@n.o'],
+                               'phone': ['0412 345 678', '1800-FLOWERS', None, '', '', '1', '2']})
+        content = 'natural_key,junk,email,phone\n' + ''.join(
+            '{},x,{},{}\n'.format(i, email or '', phone or '')
+            for i, email, phone in zip(range(7), table.column('email').to_pylist(),
+                                       table.column('phone').to_pylist()))
+        batch_rows = dataloader.BATCH_ROWS
+        dataloader.BATCH_ROWS = 3
+        buffers = []
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                parquet_filename = os.path.join(tmpdir, 'input.parquet')
+                arrow_filename = os.path.join(tmpdir, 'input.arrow')
+                # Row groups of 2 lines, batches of 3
+                pyarrow.parquet.write_table(table, parquet_filename, row_group_size=2)
+                with pyarrow.OSFile(arrow_filename, 'wb') as arrow_fd, \
+                        pyarrow.ipc.new_file(arrow_fd, table.schema) as arrow_writer:
+                    arrow_writer.write_table(table)
+                readers = [dataloader.read_csv(io.StringIO(content), ','),
+                           dataloader.ArrowReader(parquet_filename, 'parquet'),
+                           dataloader.ArrowReader(arrow_filename, 'arrow')]
+                for reader in readers:
+                    self.assertTrue(dataloader.generate_hitch_csv(reader, 2))
+                    with open(dataloader.HITCH_BUF_FILENAME, 'rb') as hitch_buf_fd:
+                        buffers.append(hitch_buf_fd.read())
+                self.assertEqual(buffers[0], buffers[1])
+                self.assertEqual(buffers[0], buffers[2])
+
+                hashed_filename = os.path.join(tmpdir, 'hashed.parquet')
+                dataloader.write_hashed_parquet(hashed_filename)
+                hashed = pyarrow.parquet.read_table(hashed_filename)
+                self.assertEqual(hashed.schema.names, ['personid', 'email', 'phone'])
+                self.assertEqual(hashed.column('personid').to_pylist(), ['0', '1', '2', '3', '4', '5', '6'])
+
+                # Lines of the first chunk skipped on resume
+                reader = dataloader.ArrowReader(parquet_filename, 'parquet')
+                dataloader.parse_headers(next(reader))
+                reader.skip(3)
+                self.assertEqual([block.columns[0] for block in reader.batches(3)],
+                                 [['3', '4', '5'], ['6']])
+
+                mapping_filename = os.path.join(tmpdir, 'mapping.parquet')
+                tokens = [{'PersonId': i, 'Token': 'token{}'.format(i)} for i in range(3)]
+                self.assertEqual(dataloader.write_output_parquet(mapping_filename, tokens), 3)
+                self.assertEqual(pyarrow.parquet.read_table(mapping_filename).to_pylist()[0],
+                                 {'personid': '0', 'token': 'token0'})
+        finally:
+            dataloader.BATCH_ROWS = batch_rows
+            dataloader.clean_buf_env()
+
+    def test_hash_cache(self):
+        """test_hash_cache counts hits and misses of repeated values"""
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['email']['salt'] = '9da8b01a3ab64fcc8e39ebd5c4cf21e7'
+        dataloader.DATABANK_SENATE_MATCHING_MAPPING['postcode']['salt'] = 'ff14d4eff61149c193d5b212f2c2d15b'
+        dataloader.configure_hash_cache(1)
+        try:
+            dataloader.parse_headers(['natural_key', 'postcode', 'email'])
+            for personid in ['1', '2', '3']:
+                self.assertEqual(dataloader.parse_line([personid, '2000', personid + '@b.c']),
+                                 [personid, dataloader.senate_hash('postcode', '2000'),
+                                  dataloader.senate_hash('email', personid + '@b.c')])
+            # Mostly unique fields such as email do not go through the cache
+            self.assertEqual(dataloader.hash_cache_counters(), (2, 1))
+        finally:
+            dataloader.configure_hash_cache(0)
+            del dataloader.DATABANK_SENATE_MATCHING_MAPPING['postcode']['salt']
+            dataloader.DATABANK_HEADERS.clear()
+            dataloader.MATCH.clear()
+        self.assertEqual(dataloader.hash_cache_counters(), (0, 0))
+
+    @responses.activate
+    def test_chunk_uploader(self):
+        """test_chunk_uploader uploads one chunk per line and aggregates the status codes"""
+        hostname = 'http://localhost/'
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        # The 503 below is final without retries
+        dataloader.configure_transport(retries=0)
+        responses.add(responses.POST, hostname + 'LoadHashedRecords', status=200)
+        responses.add(responses.POST, hostname + 'LoadHashedRecords', status=503)
+        responses.add(responses.POST, hostname + 'LoadHashedRecords', status=200)
+
+        uploader = dataloader.ChunkUploader(hostname, 'dbuuid', auth, False,
+                                            chunk_rows=1, parallel_uploads=1)
+        with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+            self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ','),
+                                                          uploader=uploader))
+        self.assertEqual(uploader.close(), 503)
+        # Hashing stops once a chunk has been rejected, the next one may be in flight by then
+        self.assertIn(len(responses.calls), [2, 3])
+        for call in responses.calls:
+            self.assertIn(b'personid,email,phone\r\n', call.request.body)
+            self.assertIn('DBUUID=dbuuid', call.request.url)
+
+        # At least one upload is in flight
+        with self.assertRaises(argparse.ArgumentTypeError):
+            dataloader.positive_int('0')
+        args = argparse.Namespace(input=io.StringIO('personid\n1\n'), uuid='dbuuid', hashed=True,
+                                  parallel_uploads=0)
+        self.assertEqual(dataloader.Loader().load(args, hostname, auth, False), (1, 0))
+
+    @responses.activate
+    def test_upload_file_chunks(self):
+        """test_upload_file_chunks cuts a file too large for a single upload at line
+        boundaries outside quotes, and uploads every chunk with the header"""
+        content = b'personid,email\r\n1,"a\r\nb"\r\n2,c\r\n3,"d,""\ne"""\r\n4,\r\n'
+        for chunk_bytes in range(1, len(content) + 1):
+            chunks = list(dataloader.split_rows(io.BytesIO(content), chunk_bytes))
+            self.assertEqual(b''.join(chunks), content)
+            self.assertEqual([row for chunk in chunks for row in csv.reader(io.StringIO(chunk.decode()))],
+                             list(csv.reader(io.StringIO(content.decode()))))
+
+        hostname = 'http://localhost/'
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        responses.add(responses.POST, hostname + 'LoadHashedRecords', status=200)
+        upload_size_limit, upload_chunk_bytes = dataloader.UPLOAD_SIZE_LIMIT, dataloader.UPLOAD_CHUNK_BYTES
+        with tempfile.TemporaryDirectory() as tmpdir:
+            hashed_filename = os.path.join(tmpdir, 'hashed.csv')
+            with open(hashed_filename, 'wb') as hashed_fd:
+                hashed_fd.write(content)
+            try:
+                dataloader.UPLOAD_SIZE_LIMIT, dataloader.UPLOAD_CHUNK_BYTES = 16, 8
+                self.assertEqual(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False,
+                                                                hashed_filename), 200)
+                chunk_count = len(responses.calls)
+                self.assertGreater(chunk_count, 1)
+                for call in responses.calls:
+                    self.assertIn(b'personid,email\r\n', call.request.body)
+                dataloader.UPLOAD_SIZE_LIMIT = upload_size_limit
+                self.assertEqual(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False,
+                                                                hashed_filename), 200)
+                self.assertEqual(len(responses.calls), chunk_count + 1)
+                self.assertIn(content, responses.calls[chunk_count].request.body)
+
+                # A compressed buffer is split the same way, on its uncompressed size
+                dataloader.BUFFER_COMPRESSION = True
+                for size_limit, requests_count in [(len(content), 1), (16, chunk_count)]:
+                    dataloader.UPLOAD_SIZE_LIMIT = size_limit
+                    with dataloader.open_hitch_buf('wb') as hitch_buf_fd:
+                        hitch_buf_fd.write(content)
+                    calls_count = len(responses.calls)
+                    self.assertEqual(dataloader.load_hashed_records(hostname, 'dbuuid', auth, False), 200)
+                    self.assertEqual(len(responses.calls) - calls_count, requests_count)
+                self.assertIn(content, responses.calls[chunk_count + 1].request.body)
+            finally:
+                dataloader.UPLOAD_SIZE_LIMIT, dataloader.UPLOAD_CHUNK_BYTES = upload_size_limit, upload_chunk_bytes
+                dataloader.BUFFER_COMPRESSION = False
+                dataloader.clean_buf_env()
+
+    @responses.activate
+    def test_resume_load(self):
+        """test_resume_load only uploads the chunks not accepted by a previous run"""
+        hostname = 'http://localhost/'
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        fixture = '{}/fixtures/00_input.csv'.format(localpath)
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        dataloader.configure_transport(retries=0)
+        for status in [200, 503, 200, 200]:
+            responses.add(responses.POST, hostname + 'LoadHashedRecords', status=status)
+
+        manifest_filename = dataloader.load_manifest_filename('dbuuid')
+        try:
+            statuses = []
+            for resume in [False, True]:
+                with open(fixture, 'rt', encoding='UTF-8') as input_fd:
+                    identity = dataloader.input_identity(input_fd, 'dbuuid', 1)
+                    manifest = dataloader.LoadManifest(manifest_filename, identity)
+                    if resume:
+                        manifest = dataloader.LoadManifest.load(manifest_filename, identity)
+                    uploader = dataloader.ChunkUploader(hostname, 'dbuuid', auth, False,
+                                                        chunk_rows=1, parallel_uploads=1,
+                                                        manifest=manifest)
+                    dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ','), uploader=uploader)
+                    statuses.append(uploader.close())
+                    if not resume:
+                        first_calls = len(responses.calls)
+                        self.assertEqual(manifest.first_pending(), 1)
+                        self.assertTrue(os.path.exists(manifest_filename))
+        finally:
+            if os.path.exists(manifest_filename):
+                os.remove(manifest_filename)
+
+        self.assertEqual(statuses, [503, 200])
+        # The first chunk is not uploaded again and the manifest is removed once complete
+        # The chunk after the rejected one may have been in flight, and accepted, already
+        bodies = [call.request.body for call in responses.calls]
+        self.assertIn(first_calls, [2, 3])
+        self.assertEqual(len(bodies), 4)
+        self.assertIn(b'\r\n1,', bodies[0])
+        self.assertIn(b'\r\n2,', bodies[first_calls])
+        self.assertEqual([body for body in bodies if b'\r\n3,' in body],
+                         [bodies[3 if first_calls == 2 else 2]])
+        self.assertFalse(os.path.exists(manifest_filename))
+
+        # Lines read from stdin cannot be checked against the manifest
+        args = argparse.Namespace(input=io.StringIO('personid\n1\n'), uuid='dbuuid', hashed=True,
+                                  chunk_rows=0, resume=True, hash_cache=0, stream=False,
+                                  parallel_uploads=1)
+        self.assertEqual(dataloader.Loader().load(args, hostname, auth, False), (1, 0))
+        self.assertEqual(len(responses.calls), 4)
+
+    def test_load_manifest(self):
+        """test_load_manifest appends a line per chunk, the last status of a chunk winning"""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest_filename = os.path.join(tmpdir, 'load.manifest.jsonl')
+            identity = {'dbuuid': 'dbuuid', 'chunk_rows': 2, 'input': 'input.csv'}
+            manifest = dataloader.LoadManifest(manifest_filename, identity)
+            for index, status in [(0, 200), (1, 503), (2, 200), (1, 200)]:
+                manifest.record(index, 'chunk_{}.csv'.format(index), 'sha{}'.format(index), status)
+            with open(manifest_filename, 'rt', encoding='UTF-8') as manifest_fd:
+                lines = manifest_fd.read().splitlines()
+            self.assertEqual(len(lines), 5)
+            self.assertEqual(json.loads(lines[0]), {'identity': identity})
+            with open(manifest_filename, 'at', encoding='UTF-8') as manifest_fd:
+                manifest_fd.write('{"index": 3, "file')
+
+            resumed = dataloader.LoadManifest.load(manifest_filename, identity)
+            self.assertEqual(resumed.first_pending(), 3)
+            self.assertTrue(resumed.accepted(1, 'sha1'))
+            self.assertEqual(resumed.chunks[2]['rows'], [4, 6])
+            with open(manifest_filename, 'rt', encoding='UTF-8') as manifest_fd:
+                self.assertEqual(len(manifest_fd.read().splitlines()), 4)
+            self.assertEqual(dataloader.LoadManifest.load(manifest_filename, dict(identity, chunk_rows=3))
+                             .chunks, {})
+
+    def test_iter_json_array(self):
+        """test_iter_json_array decodes elements split across chunks"""
+        payload = json.dumps([{'PersonId': '1', 'Token': 'tök€n'}, 12345, 'x, ]', []]).encode('utf-8')
+        for chunk_size in [1, 2, 7, len(payload)]:
+            chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+            self.assertEqual(list(dataloader.iter_json_array(chunks)),
+                             [{'PersonId': '1', 'Token': 'tök€n'}, 12345, 'x, ]', []])
+        with self.assertRaises(ValueError):
+            list(dataloader.iter_json_array([b'[{"PersonId": 1}, {"Tok']))
+
+    @responses.activate
+    def test_stream_loaded_tokens(self):
+        """test_stream_loaded_tokens writes the mapping while downloading it"""
+        hostname = 'http://localhost/'
+        auth = HTTPBasicAuth('api', 'passw0rd')
+        tokens = [{'PersonId': str(i), 'Token': 'token{}'.format(i)} for i in range(3)]
+        responses.add(responses.GET, hostname + 'GetPersonTokens', json=tokens, status=200)
+        responses.add(responses.GET, hostname + 'GetPersonTokens', json=[], status=200)
+
+        output = io.StringIO()
+        self.assertEqual(dataloader.stream_loaded_tokens(hostname, 'dbuuid', auth, output, False),
+                         (3, True))
+        self.assertEqual(output.getvalue(),
+                         'personid,token\r\n0,token0\r\n1,token1\r\n2,token2\r\n')
+        output = io.StringIO()
+        self.assertEqual(dataloader.stream_loaded_tokens(hostname, 'dbuuid', auth, output, False),
+                         (0, True))
+        self.assertEqual(output.getvalue(), '')
+
+    def test_mapped_csv(self):
+        """test_mapped_csv reads the same lines as read_csv, by blocks of byte ranges"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        with open('{}/fixtures/00_input.csv'.format(localpath), 'rt', encoding='UTF-8') as input_fd:
+            expected = list(dataloader.read_csv(input_fd, ','))
+        with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as crlf_fd:
+            for line in expected:
+                crlf_fd.write((','.join(line) + '\r\n').encode('utf-8'))
+        try:
+            for batch_rows in [1, 2, 5]:
+                reader = dataloader.MappedCSV(crlf_fd.name, ',')
+                self.assertEqual(next(reader), expected[0])
+                batches = list(dataloader.iter_batches(reader, batch_rows))
+                self.assertEqual(len(batches), -(-3 // batch_rows))
+                self.assertEqual([row for batch in batches for row in batch.rows()], expected[1:])
+
+                reader.close()
+
+            reader = dataloader.MappedCSV(crlf_fd.name, ',')
+            next(reader)
+            dataloader.skip_lines(reader, 2)
+            self.assertEqual([batch.rows() for batch in reader.batches(10)], [expected[3:]])
+            reader.close()
+            self.assertEqual(dataloader.OPEN_MAPPED_FILES, {})
+
+            # A replaced file is mapped again, by the readers and by the worker processes
+            old_block = dataloader.MappedBlock(reader.key, 0, reader.key[2], ',', len(expected[0]))
+            self.assertEqual(len(old_block.rows()), 4)
+            with tempfile.NamedTemporaryFile('wb', suffix='.csv', delete=False) as new_fd:
+                new_fd.write(b'personid,email\r\n9,new@example.com\r\n')
+            os.replace(new_fd.name, crlf_fd.name)
+            reader = dataloader.MappedCSV(crlf_fd.name, ',')
+            self.assertEqual(next(reader), ['personid', 'email'])
+            blocks = list(reader.batches(10))
+            reader.close()
+            self.assertEqual([block.rows() for block in blocks], [[['9', 'new@example.com']]])
+            self.assertEqual(list(dataloader.MAPPED_FILES), [blocks[0].key])
+            with self.assertRaises(OSError):
+                old_block.rows()
+        finally:
+            os.remove(crlf_fd.name)
+            dataloader.MAPPED_FILES.clear()
+
+    def test_stats(self):
+        """test_stats counts rows and bytes without changing the buffer"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        fixture = '{}/fixtures/00_input.csv'.format(localpath)
+        buffers = []
+        try:
+            for stats in [None, dataloader.Stats(progress_seconds=0)]:
+                dataloader.STATS = stats
+                with open(fixture, 'rt', encoding='UTF-8') as input_fd:
+                    self.assertTrue(dataloader.generate_hitch_csv(dataloader.read_csv(input_fd, ',')))
+                with open(dataloader.HITCH_BUF_FILENAME, 'rb') as hitch_buf_fd:
+                    buffers.append(hitch_buf_fd.read())
+        finally:
+            dataloader.STATS = None
+            dataloader.clean_buf_env()
+        self.assertEqual(buffers[0], buffers[1])
+
+        summary = stats.summary()
+        header_size = len(buffers[1].split(b'\r\n')[0]) + 2
+        self.assertEqual(summary['counters']['rows_read'], 3)
+        self.assertEqual(summary['counters']['rows_hashed'], 3)
+        self.assertEqual(summary['counters']['rows_dropped_empty'], 0)
+        self.assertEqual(summary['counters']['bytes_read'], os.path.getsize(fixture))
+        self.assertEqual(summary['counters']['bytes_written'], len(buffers[1]) - header_size)
+        self.assertEqual(set(summary['stages_seconds']),
+                         {'read_csv', 'normalize', 'senate_hash', 'csv_encode', 'write'})
+
+        # Reading the tokens of GetPersonTokens is not reading the input
+        def slow_tokens():
+            time.sleep(0.05)
+            yield {'PersonId': '1', 'Token': 'token1'}
+        dataloader.STATS = stats = dataloader.Stats(progress_seconds=0)
+        try:
+            self.assertEqual(dataloader.write_output(io.StringIO(), slow_tokens()), 1)
+        finally:
+            dataloader.STATS = None
+        self.assertNotIn('read_csv', stats.summary()['stages_seconds'])
+
+    def test_startup_imports(self):
+        """test_startup_imports checks with python -X importtime that importing dataloader
+        defers the heavy modules to their first use, and sets no logging handler"""
+        localpath = os.path.dirname(os.path.realpath(__file__))
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                                 'import dataloader; print(len(dataloader.logger.handlers))'],
+                                cwd=os.path.join(localpath, '..'), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, check=True)
+        self.assertEqual(result.stdout.strip(), b'0')
+        imported = set()
+        for line in result.stderr.decode('utf-8').splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                imported.add(line.split('|')[-1].strip().split('.')[0])
+        self.assertIn('dataloader', imported)
+        for module in ['distutils', 'requests', 'urllib3', 'regex', 'asyncio', 'pyarrow',
+                       'zstandard']:
+            self.assertNotIn(module, imported)
+
+        self.assertEqual(dataloader.strtobool('Yes'), 1)
+        self.assertEqual(dataloader.strtobool('off'), 0)
+        with self.assertRaises(ValueError):
+            dataloader.strtobool('/etc/ssl/ca.pem')
+        self.assertEqual(dataloader.normalize_name('Mc Mahon-1'), 'mcmahon')
+        self.assertEqual(dataloader.normalize_email(' User@Ｅxample.com　'), 'user@example.com')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,57 +2,158 @@
 #
 # csv2hitchcsv.py
 #
-# Usage: 
-#   $ csv2hitchcsv.py --salt SALT --input original.csv --output hashedfile.csv
+# Usage:
+#   $ csv2hitchcsv.py --salts salts.json --input original.csv --output hashedfile.csv
+#
+# Hashes a Databank or Senate Matching CSV offline, so that it can be loaded later
+# with dataloader.py --hashed. The hashing is the one of dataloader.py:
+#   - Columns are picked by header name, as dataloader.py does. personid is kept
+#     as is, so are the fields declared without salt (e.g. operation), unexpected
+#     columns are dropped with a warning.
+#   - Values are normalized, then salted with the salt of their field and hashed.
+#     Empty values, and values such as "-" once normalized, are not hashed and
+#     stay blank.
+#   - The output header is made of the Senate Matching field names.
+#
+# The salts file is JSON, either the GlobalConfig payload of the Contributor Node,
+# the salt cache of dataloader.py --salt-cache or the salt of every field:
+#   {"email": "9da8b01a3ab64fcc8e39ebd5c4cf21e7", "phone": "ff14d4eff61149c193d5b212f2c2d15b"}
+#
+# Lines are hashed by batches on --workers processes and written in input order.
+# A throughput report is printed on stderr once done.
 #
-# Assumptions:
-#   - This script assumes data has been normalized already
-#     (i.e. leading and trailing spaces trimmed, case changed, etc).
-#   - This script assumes the first column is always PersonID which 
-#     will NOT be hashed.
-#   - This script assumes the last column is always Operation which
-#     will NOT be hashed.
-#   - Empty values (blank, undefined, null) should not be
-#     hashed. This script assumes such values evaluate to False
-#     in Python. 
-#   - Values such as "-" should also NOT be hashed and replaced
-#     instead with blank (empty string).
-#   
 
 import argparse
-import hashlib
-import base64
 import csv
+import json
+import os
 import sys
 
-parser = argparse.ArgumentParser(description="A tool to hash records in a csv file so it can be used by Senate Matching")
-parser.add_argument('-u', '--salt', help='Salt value', required=True)
-parser.add_argument('-i', '--input', help='Read from filename. The file must be readable '
-                                          'and in CSV format encoded in UTF-8',
-                    type=argparse.FileType('rt', encoding='UTF-8'),
-                    default=sys.stdin,
-                    required=False)
-parser.add_argument('-o', '--output', help='Write the hashed results to filename in CSV format',
-                    type=argparse.FileType('wt', encoding='UTF-8'),
-                    default=sys.stdout,
-                    required=False)
-args = parser.parse_args()
-
-csvreader = csv.reader(args.input, delimiter=',')
-
-csvwriter = csv.writer(args.output, skipinitialspace=True,
-                        delimiter=',', quoting=csv.QUOTE_NONE)
-
-row_count = 0
-for row in csvreader:
-    row_count += 1
-    if row_count > 1:
-        for i in range(1, len(row) - 1):
-            # Do not hash empty strings
-            if row[i] and row[i] not in ['-', 'NA', ' ']:
-                hsh = hashlib.sha512((row[i] + args.salt).encode('utf-8'))
-                row[i] = base64.b64encode(hsh.digest()).decode('utf-8')
-            else:
-                row[i] = ''
-            
-    csvwriter.writerow(row)
\ No newline at end of file
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import dataloader
+
+
+def load_salts(filename):
+    """load_salts sets the salts of the salts file, see the usage above"""
+    with open(filename, 'rt', encoding='UTF-8') as salts_fd:
+        payload = json.load(salts_fd)
+    if 'Fields' in payload:
+        payload = dataloader.global_config_salts(payload)
+    elif payload.get('version') == dataloader.SALT_CACHE_VERSION and 'salts' in payload:
+        payload = payload['salts']
+    for field, salt in payload.items():
+        if field not in dataloader.DATABANK_SENATE_MATCHING_MAPPING:
+            dataloader.logger.warning('Warning: [{}] salt is not expected and will be ignored'.format(field))
+        elif dataloader.DATABANK_SENATE_MATCHING_MAPPING[field].get('salt', True):
+            dataloader.DATABANK_SENATE_MATCHING_MAPPING[field]['salt'] = salt
+
+
+def missing_salts(headers):
+    """missing_salts returns the fields of headers to hash without a salt"""
+    missing = []
+    for _, _, field in dataloader.row_plan_spec(headers):
+        mapping = dataloader.DATABANK_SENATE_MATCHING_MAPPING[field]
+        if not mapping.get('primary', False) and mapping.get('salt') is not False \
+                and not mapping.get('salt') and field not in missing:
+            missing.append(field)
+    return missing
+
+
+def hash_csv(reader, output, workers=1):
+    """hash_csv writes the hashed lines of reader, as read_csv yields them, to output.
+    Returns False when the headers or a line are invalid"""
+    try:
+        headers = next(reader)
+    except StopIteration:
+        return True
+    try:
+        fieldnames = dataloader.parse_headers(headers)
+    except dataloader.InvalidFileHeadersError:
+        return False
+    missing = missing_salts(headers)
+    if missing:
+        dataloader.logger.error('Error: no salt for {}'.format(', '.join(missing)))
+        return False
+
+    csv.writer(output).writerow(fieldnames)
+    try:
+        for hashed_batch in dataloader.hash_batches(reader, headers, workers):
+            output.write(hashed_batch)
+    except (dataloader.InvalidLineError, dataloader.InvalidFileHeadersError):
+        return False
+    return True
+
+
+def report_throughput(stats):
+    """report_throughput prints the rows and bytes hashed per second on stderr"""
+    summary = stats.summary()
+    counters = summary['counters']
+    wall_seconds = summary['wall_seconds'] or 1e-9
+    print('{} rows read, {} rows hashed in {:.1f}s: {:.0f} rows/s, {:.1f} MB/s read'.format(
+        counters.get('rows_read', 0), counters.get('rows_hashed', 0), summary['wall_seconds'],
+        counters.get('rows_read', 0) / wall_seconds,
+        counters.get('bytes_read', 0) / wall_seconds / (1024 * 1024)), file=sys.stderr)
+
+
+def main():
+    dataloader.setup_logging()
+    parser = argparse.ArgumentParser(description="A tool to hash records in a csv file so it can be used by Senate Matching")
+    parser.add_argument('-s', '--salts', help='JSON file of the salt of every field, GlobalConfig payload or salt cache',
+                        required=True)
+    parser.add_argument('-i', '--input', help='Read from filename. The file must be readable '
+                                              'and in CSV format encoded in UTF-8',
+                        type=argparse.FileType('rt', encoding='UTF-8'),
+                        default=sys.stdin,
+                        required=False)
+    parser.add_argument('-o', '--output', help='Write the hashed results to filename in CSV format',
+                        type=argparse.FileType('wt', encoding='UTF-8'),
+                        default=sys.stdout,
+                        required=False)
+    parser.add_argument('-d', '--delimiter',
+                        help='Delimiter of the input CSV. Comma by default',
+                        default=',',
+                        required=False)
+    parser.add_argument('--workers',
+                        type=int,
+                        help='Number of processes hashing the file. 1 by default',
+                        default=1,
+                        required=False)
+    parser.add_argument('--mmap',
+                        action='store_true',
+                        help='Memory map the input file, lines being only decoded by the process '
+                             'hashing them. Ignored for stdin',
+                        required=False)
+    parser.add_argument('--hash-cache',
+                        type=float,
+                        help='Memory ceiling in MB of the cache of hashed values, per process. '
+                             '0 disables it, 64 by default',
+                        default=64,
+                        required=False)
+    parser.add_argument('--progress-interval',
+                        type=float,
+                        help='Seconds between two progress lines on stderr. 30 by default',
+                        default=dataloader.STATS_PROGRESS_SECONDS,
+                        required=False)
+    args = parser.parse_args()
+
+    try:
+        load_salts(args.salts)
+    except (IOError, ValueError, KeyError, AttributeError) as ex:
+        dataloader.logger.error('Error: invalid salts file {}: {}'.format(args.salts, ex))
+        exit(1)
+    dataloader.configure_hash_cache(args.hash_cache)
+    dataloader.STATS = dataloader.Stats(args.progress_interval)
+
+    if args.mmap and args.input != sys.stdin:
+        reader = dataloader.MappedCSV(args.input.name, args.delimiter, exit_on_failure=True)
+    else:
+        reader = dataloader.read_csv(args.input, args.delimiter, exit_on_failure=True)
+    hashed = hash_csv(reader, args.output, args.workers)
+    args.output.flush()
+    report_throughput(dataloader.STATS)
+    if not hashed:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()